@@ -0,0 +1,290 @@
+"""An asyncio couchdb client for commands that fan out many requests.
+
+couchdb-python makes one request at a time. The :class:`Client` here makes its
+requests on stdlib asyncio streams, over keep-alive connections of its own,
+so a command can :func:`gather` many of them with a concurrency limit. It
+only speaks the JSON requests those commands need.
+
+:meth:`Client.from_resource` takes the pool size, timeouts, TCP keep-alive,
+TLS settings and compression settings of a :class:`cdbcli.session.Session`.
+Unlike the session, it doesn't resume TLS sessions when it reconnects, as
+asyncio can't hand a TLS session to a new connection, so it keeps its
+connections open instead.
+
+:func:`cdbcli.repl.eval_` gives every command a :class:`Runner` as
+``environment.aio``, whose event loop and connections last across commands.
+"""
+import asyncio
+import gzip
+import json
+import ssl
+import threading
+import zlib
+from urllib.parse import quote, urlencode, urlsplit
+
+import couchdb
+import couchdb.http
+
+from cdbcli.session import COMPRESS_MIN_SIZE, DEFAULT_POOL_SIZE, Session, _set_keepalive
+
+
+DEFAULT_CONCURRENCY = 8
+
+# asyncio.Task.all_tasks is gone from python 3.9, asyncio.all_tasks only came with 3.7
+_all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+
+
+def _raise_for_status(status, body):
+    # like couchdb's own errors, always an (error, reason) pair, e.g., for the HTML page of a proxy
+    if isinstance(body, dict):
+        error = body.get('error'), body.get('reason')
+    else:
+        error = 'unknown_error', body or 'HTTP status {}'.format(status)
+    if status == 401:
+        raise couchdb.Unauthorized(error)
+    elif status == 404:
+        raise couchdb.ResourceNotFound(error)
+    elif status == 409:
+        raise couchdb.ResourceConflict(error)
+    elif status == 412:
+        raise couchdb.PreconditionFailed(error)
+    raise couchdb.ServerError((status, error))
+
+
+def _encode_param(value):
+    # like couchdb-python, everything but strings is sent as JSON, e.g., include_docs=true
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class Client():
+    """A client of the couchdb resource at ``url``, e.g., a server or a database.
+
+    :param credentials: the ``(username, password)`` to authenticate with
+    :param pool_size: the number of idle connections to keep
+    :param connect_timeout: the seconds to wait for a connection to be established, ``None`` to wait forever
+    :param read_timeout: the seconds to wait for a response, ``None`` to wait forever
+    :param keepalive: whether to turn on TCP keep-alive
+    :param accept_gzip: whether to ask for gzip compressed responses
+    :param compress_requests: whether to gzip request bodies of ``COMPRESS_MIN_SIZE`` bytes or more, until the
+                              server answers one with ``415 Unsupported Media Type``
+    :param ssl_context: the TLS settings for https URLs
+    :param counter: the :class:`cdbcli.session.TransferCounter` to count the requests and bytes with
+    """
+    def __init__(self, url, credentials=None, pool_size=DEFAULT_POOL_SIZE, connect_timeout=None, read_timeout=None,
+                 keepalive=True, accept_gzip=True, compress_requests=False, ssl_context=None, counter=None):
+        parts = urlsplit(url)
+        self.url = url
+        self._host = parts.hostname
+        self._port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self._path = parts.path.rstrip('/')
+        self._ssl_context = (ssl_context or ssl.create_default_context()) if parts.scheme == 'https' else None
+        self._authorization = couchdb.http.basic_auth(credentials)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive = keepalive
+        self.accept_gzip = accept_gzip
+        self.compress_requests = compress_requests
+        self._counter = counter
+        self._idle = []
+
+    @classmethod
+    def from_resource(cls, resource):
+        """Return a client of ``resource``, with the connection settings of its :class:`cdbcli.session.Session`."""
+        session = resource.session
+        if not isinstance(session, Session):
+            return cls(resource.url, resource.credentials)
+
+        pool = session.connection_pool
+        return cls(resource.url, resource.credentials, pool.pool_size, pool.connect_timeout, pool.read_timeout,
+                   pool.keepalive, session.accept_gzip, session.compress_requests, pool.ssl_context, pool.counter)
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port, ssl=self._ssl_context), self.connect_timeout)
+        if self.keepalive:
+            _set_keepalive(writer.get_extra_info('socket'))
+        return reader, writer
+
+    def _build_request(self, method, path, body, params, compressed=False):
+        target = '/'.join([self._path] + [quote(segment, safe='') for segment in path]) or '/'
+        if params:
+            target += '?' + urlencode([(name, _encode_param(value)) for name, value in params.items()])
+
+        headers = ['{} {} HTTP/1.1'.format(method, target), 'Host: {}:{}'.format(self._host, self._port),
+                   'Accept: application/json', 'Content-Length: {}'.format(len(body))]
+        if body:
+            headers.append('Content-Type: application/json')
+        if compressed:
+            headers.append('Content-Encoding: gzip')
+        if self.accept_gzip:
+            headers.append('Accept-Encoding: gzip')
+        if self._authorization:
+            headers.append('Authorization: {}'.format(self._authorization.decode('ascii')))
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body
+
+    async def _read_response(self, reader, method):
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if method == 'HEAD' or status in (204, 304):
+            content = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while await reader.readline() not in (b'\r\n', b'\n', b''):
+                        pass  # the trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            content = await reader.read()
+            headers['connection'] = 'close'
+        return status, headers, content
+
+    async def request(self, method, *path, body=None, **params):
+        """Make a request to ``path``, the segments below the client's URL, and return the decoded JSON response.
+
+        A request that fails on a connection that was idle is retried on another connection, as the server may
+        have closed the idle one in the meantime, so only use this for requests that can be repeated.
+
+        :param body: the value to send as JSON
+        :param params: the query parameters, values other than strings are sent as JSON
+        """
+        body = json.dumps(body).encode('utf-8') if body is not None else b''
+        if self.compress_requests and len(body) >= COMPRESS_MIN_SIZE:
+            try:
+                return await self._request(method, path, gzip.compress(body), params, compressed=True)
+            except couchdb.ServerError as e:
+                status, _ = e.args[0]
+                if status != 415:
+                    raise
+                self.compress_requests = False
+        return await self._request(method, path, body, params)
+
+    async def _request(self, method, path, body, params, compressed=False):
+        request = self._build_request(method, path, body, params, compressed)
+        while True:
+            reused = bool(self._idle)
+            reader, writer = self._idle.pop() if reused else await self._connect()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, headers, content = await asyncio.wait_for(self._read_response(reader, method),
+                                                                  self.read_timeout)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused:
+                    continue
+                if isinstance(e, asyncio.IncompleteReadError):
+                    # it's an EOFError, which the repl would take for exit
+                    raise ConnectionResetError('Connection closed before the response was read') from e
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+        if headers.get('connection', '').lower() != 'close' and len(self._idle) < self.pool_size:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+        received = len(content)
+        if headers.get('content-encoding', '').lower() in ('gzip', 'x-gzip'):
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        if self._counter is not None:
+            self._counter.add(requests=1, sent=len(body), received=received, decoded=len(content))
+
+        if status >= 400:
+            text = content.decode('utf-8', 'replace')
+            try:
+                value = json.loads(text)
+            except ValueError:
+                value = text.strip()
+            _raise_for_status(status, value)
+        return json.loads(content.decode('utf-8')) if content else None
+
+    async def get_json(self, *path, **params):
+        return await self.request('GET', *path, **params)
+
+    async def post_json(self, *path, body=None, **params):
+        return await self.request('POST', *path, body=body, **params)
+
+    def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+async def gather(coroutines, limit=DEFAULT_CONCURRENCY):
+    """Await ``coroutines``, at most ``limit`` at a time, and return their results in order.
+
+    If one of them fails, the others are cancelled.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    tasks = [asyncio.ensure_future(run(coroutine)) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class Runner():
+    """Run the coroutines of commands on an event loop of its own, which keeps the connections of its clients."""
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, couch_object):
+        """Return the client of ``couch_object``, a couchdb server or database."""
+        resource = couch_object.resource
+        key = resource.url, resource.credentials
+        if key not in self._clients:
+            self._clients[key] = Client.from_resource(resource)
+        return self._clients[key]
+
+    def run(self, coroutine):
+        """Run ``coroutine`` to completion and return its result."""
+        with self._lock:
+            try:
+                return self._loop.run_until_complete(coroutine)
+            except BaseException:
+                # e.g., Ctrl+C, don't leave the tasks behind to run with the next command
+                tasks = _all_tasks(self._loop)
+                if tasks:
+                    for task in tasks:
+                        task.cancel()
+                    self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                raise
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+        self._clients = {}
+        self._loop.run_until_complete(asyncio.sleep(0))  # let the connections close
+        self._loop.close()
@@ -0,0 +1,117 @@
+import bisect
+import collections
+import threading
+import time
+
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_SIZE = 256
+# The most doc ids fetched for a completion prefix, an entry this long may be missing ids.
+DOC_ID_COMPLETION_LIMIT = 100
+
+
+def cache_key(couch_server, database, kind):
+    """Build the cache key for a word list of ``kind`` in ``database`` on ``couch_server``.
+
+    :param couch_server: the couchdb server
+    :param database: the database (or database name) the words belong to, ``None`` for the server root
+    :param kind: the kind of word list, e.g., ``doc_ids`` or ``db_names``
+    """
+    if database is not None and not isinstance(database, str):
+        database = database.name
+    return couch_server.resource.url, database, kind
+
+
+def doc_id_prefix_keys(couch_server, database, doc_id):
+    """Yield the keys of every doc id prefix entry that ``doc_id`` falls into."""
+    for i in range(len(doc_id) + 1):
+        yield cache_key(couch_server, database, ('doc_ids', doc_id[:i]))
+
+
+class CompletionCache():
+    """A TTL and LRU bounded cache for the word lists used by the tab completer.
+
+    Every entry is a sorted list of words. Commands that mutate the server
+    keep the entries up-to-date with :meth:`add` and :meth:`discard`, or drop
+    them with :meth:`invalidate` when the change can't be applied precisely.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, words = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return words
+
+    def lookup(self, key):
+        """Return the words for ``key``, or ``None`` when the entry is missing or expired."""
+        with self._lock:
+            return self._get_entry(key)
+
+    def get(self, key, fetch):
+        """Return the words for ``key``, calling ``fetch`` to populate the entry when missing or expired."""
+        with self._lock:
+            words = self._get_entry(key)
+            if words is not None:
+                return words
+
+        words = sorted(fetch())
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, words)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return words
+
+    def add(self, key, word):
+        """Add ``word`` to the entry for ``key``, if it's cached."""
+        with self._lock:
+            words = self._get_entry(key)
+            if words is None:
+                return
+            index = bisect.bisect_left(words, word)
+            if index == len(words) or words[index] != word:
+                words.insert(index, word)
+
+    def discard(self, key, word, complete_below=None):
+        """Remove ``word`` from the entry for ``key``, if it's cached.
+
+        :param complete_below: entries with this many words or more are truncated lists, which would look complete
+                               after the discard, so they're dropped instead
+        """
+        with self._lock:
+            words = self._get_entry(key)
+            if words is None:
+                return
+            if complete_below is not None and len(words) >= complete_below:
+                del self._entries[key]
+                return
+            index = bisect.bisect_left(words, word)
+            if index < len(words) and words[index] == word:
+                del words[index]
+
+    def invalidate(self, key):
+        """Drop the entry for ``key``."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_prefix(self, key_prefix):
+        """Drop every entry whose key starts with ``key_prefix``, e.g., everything of a database."""
+        with self._lock:
+            for key in [key for key in self._entries if key[:len(key_prefix)] == key_prefix]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,12 +1,24 @@
+import concurrent.futures
+import fnmatch
 import functools
+import gzip
+import http.client
 import io
 import json
+import os
+import re
+import sys
 import traceback
 import tempfile
+import time
 
 import couchdb
-from collections import namedtuple
-from cdbcli import utils, highlighters
+from collections import deque, namedtuple
+from couchdb.client import Row
+from cdbcli import aio, utils, highlighters
+from cdbcli.cache import DOC_ID_COMPLETION_LIMIT, cache_key, doc_id_prefix_keys
+from cdbcli.environment import PipeClosed
+from cdbcli.session import Session
 
 
 COMMANDS = {}
@@ -49,31 +61,320 @@ def get_all_dbs(environment, couch_server):
     return response
 
 
+DBS_INFO_BATCH_SIZE = 100
+DB_INFO_CONCURRENCY = 8
+
+
+async def _get_db_info(client, db_name):
+    try:
+        return await client.get_json(db_name)
+    except couchdb.ResourceNotFound:
+        return None
+
+
+async def _get_dbs_info(client, db_names):
+    response = await client.post_json('_dbs_info', body={'keys': db_names})
+    return [result.get('info') for result in response]
+
+
+def iter_db_infos(environment, couch_server, db_names):
+    """Yield ``(db_name, info)`` for each database, in the order of ``db_names``.
+
+    The ``_dbs_info`` bulk endpoint is used when the server supports it,
+    otherwise the databases are fetched concurrently with ``GET /db`` on the
+    environment's asyncio runner. ``info`` is ``None`` for databases that no
+    longer exist.
+    """
+    client = environment.aio.client(couch_server)
+    db_names = list(db_names)
+    use_bulk = True
+    for i in range(0, len(db_names), DBS_INFO_BATCH_SIZE):
+        batch = db_names[i:i + DBS_INFO_BATCH_SIZE]
+        infos = None
+        if use_bulk:
+            try:
+                infos = environment.aio.run(_get_dbs_info(client, batch))
+            except couchdb.HTTPError:
+                use_bulk = False
+
+        if infos is None:
+            infos = environment.aio.run(
+                aio.gather([_get_db_info(client, db_name) for db_name in batch], DB_INFO_CONCURRENCY))
+
+        for db_name, info in zip(batch, infos):
+            yield db_name, info
+
+
 def is_view(doc):
     return doc.startswith('_design/')
 
 
+VIEW_PAGE_SIZE = 1000
+ALL_DOCS_PAGE_SIZE = 1000
+BULK_DOCS_BATCH_SIZE = 500
+DOC_ROWS_CONCURRENCY = 4
+
+
+def iter_view(database, name, page_size=None, limit=None, **options):
+    """Iterate the rows of a view one page at a time.
+
+    Each page is requested with one extra row, which becomes the
+    ``startkey``/``startkey_docid`` of the next page, so only a single page
+    of rows is ever held in memory.
+
+    :param database: the database holding the view
+    :param name: the name of the view, e.g., ``_all_docs`` or ``_design/users/_view/by_lastname``
+    :param page_size: the number of rows to fetch per request
+    :param limit: the maximum number of rows to yield
+    :param options: the view query options
+    """
+    page_size = page_size or VIEW_PAGE_SIZE
+    if 'key' in options:
+        # ``key`` takes precedence over ``startkey``, which would break the page chaining
+        key = options.pop('key')
+        options['startkey'] = options['endkey'] = key
+
+    while limit is None or limit > 0:
+        page_limit = page_size if limit is None else min(page_size, limit)
+        rows = list(database.view(name, limit=page_limit + 1, **options))
+
+        for row in rows[:page_limit]:
+            yield row
+
+        if len(rows) <= page_limit:
+            return
+
+        if limit is not None:
+            limit -= page_limit
+
+        next_row = rows[page_limit]
+        options.update(startkey=next_row.key, skip=0)
+        if next_row.id is not None:
+            options['startkey_docid'] = next_row.id
+
+
+def prefix_range(prefix):
+    """Return the ``(startkey, endkey)`` pair covering every id starting with ``prefix``."""
+    return prefix, prefix + '\ufff0'
+
+
+def _all_docs_range(prefix, start):
+    if prefix:
+        startkey, endkey = prefix_range(prefix)
+        return {'startkey': max(start or startkey, startkey), 'endkey': endkey}
+    return {'startkey': start} if start else {}
+
+
+def iter_all_docs(database, prefix=None, start=None, limit=None, page_size=None, **options):
+    """Iterate the rows of ``_all_docs`` one page at a time.
+
+    Only a single page of rows is held in memory, so the first rows are
+    available as soon as the first page arrives, no matter how big the
+    database is.
+
+    :param database: the database to list
+    :param prefix: only yield documents whose id starts with ``prefix``
+    :param start: the document id to start listing from
+    :param limit: the maximum number of rows to yield
+    :param page_size: the number of rows to fetch per request
+    """
+    options.update(_all_docs_range(prefix, start))
+    return iter_view(database, '_all_docs', page_size or ALL_DOCS_PAGE_SIZE, limit=limit, **options)
+
+
+def get_doc_index(environment, database=None, max_age=0):
+    """Return the environment's document index, refreshed from the changes of ``database``.
+
+    :param database: the database to refresh the index of, the current database by default
+    :param max_age: don't refresh if the last refresh was less than this many seconds ago
+    :return: the index, or ``None`` when the environment doesn't keep one
+    """
+    database = database or environment.current_db
+    if environment.doc_index is None or database is None:
+        return None
+
+    environment.doc_index.refresh(database, max_age)
+    return environment.doc_index
+
+
+def iter_indexed_docs(doc_index, database, prefix=None, start=None, limit=None):
+    """Iterate the rows of ``_all_docs``, without the documents, from ``doc_index`` like :func:`iter_all_docs`."""
+    for doc_id, rev in doc_index.iter_docs(database, limit=limit, **_all_docs_range(prefix, start)):
+        yield Row(id=doc_id, key=doc_id, value={'rev': rev})
+
+
+def iter_batches(iterable, batch_size):
+    """Yield lists of up to ``batch_size`` items from ``iterable``."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_doc_row_pages(runner, database, batches, **options):
+    client = runner.client(database)
+    for window in iter_batches(batches, DOC_ROWS_CONCURRENCY):
+        pages = runner.run(aio.gather([client.post_json('_all_docs', body={'keys': batch}, **options)
+                                       for batch in window], DOC_ROWS_CONCURRENCY))
+        for page in pages:
+            yield [Row(row) for row in page['rows']]
+
+
+def iter_doc_rows(database, doc_ids, batch_size=None, runner=None, **options):
+    """Yield ``(doc_id, row)`` for every id in ``doc_ids``, ``row`` is ``None`` if the document doesn't exist.
+
+    The ``_all_docs`` rows are looked up ``batch_size`` ids per request. With
+    an asyncio ``runner``, up to ``DOC_ROWS_CONCURRENCY`` batches are looked
+    up at once.
+
+    :param options: the view query options, e.g., ``include_docs``
+    """
+    batches = iter_batches(doc_ids, batch_size or BULK_DOCS_BATCH_SIZE)
+    if runner is not None:
+        pages = _iter_doc_row_pages(runner, database, batches, **options)
+    else:
+        pages = (database.view('_all_docs', keys=batch, **options) for batch in batches)
+
+    for rows in pages:
+        for row in rows:
+            if row.error or (row.value or {}).get('deleted'):
+                yield row.key, None
+            else:
+                yield row.id, row
+
+
+_GLOB_RE = re.compile(r'[*?[]')
+
+
+def is_glob(pattern):
+    return _GLOB_RE.search(pattern) is not None
+
+
+def iter_glob_rows(database, pattern, doc_index=None, **options):
+    """Yield ``(doc_id, row)`` for every document whose id matches the glob ``pattern``, e.g., ``session.*``.
+
+    Only the ``_all_docs`` rows of the ids starting with the literal prefix of ``pattern`` are listed.
+    With a ``doc_index``, the ids are matched against the index, and only the rows of the matches are fetched.
+
+    :param options: the view query options, e.g., ``include_docs``
+    """
+    prefix = _GLOB_RE.split(pattern, 1)[0]
+    if doc_index is not None:
+        doc_ids = (row.id for row in iter_indexed_docs(doc_index, database, prefix=prefix or None)
+                   if fnmatch.fnmatchcase(row.id, pattern))
+        for doc_id, row in iter_doc_rows(database, doc_ids, **options):
+            if row is not None:  # deleted since the index was refreshed
+                yield doc_id, row
+        return
+
+    for row in iter_all_docs(database, prefix=prefix or None, **options):
+        if fnmatch.fnmatchcase(row.id, pattern):
+            yield row.id, row
+
+
+DocStat = namedtuple('DocStat', ['id', 'rev', 'size'])
+
+
+def _doc_resource(database, doc_id):
+    # keep the / after reserved segments, e.g., _design/users, unescaped
+    if doc_id.startswith('_'):
+        return database.resource(*doc_id.split('/', 1))
+    return database.resource(doc_id)
+
+
+def stat_doc(database, doc_id):
+    """Return the :class:`DocStat` of a document from a ``HEAD`` request, ``None`` if it doesn't exist.
+
+    The revision comes from the ``ETag`` and the size from the ``Content-Length``, so the body is never fetched.
+    """
+    try:
+        # the size of the document, not of its compressed encoding
+        _, headers, _ = _doc_resource(database, doc_id).head(headers={'Accept-Encoding': 'identity'})
+    except couchdb.ResourceNotFound:
+        return None
+
+    size = headers.get('Content-Length')
+    return DocStat(doc_id, headers.get('ETag', '').strip('"') or None, int(size) if size is not None else None)
+
+
+def get_design_docs(database):
+    """Return all the design documents of ``database``, bodies included, in a single request."""
+    rows = database.view('_all_docs', startkey='_design/', endkey='_design0', include_docs=True)
+    return [couchdb.Document(row['doc']) for row in rows if row.get('doc')]
+
+
+def _doc_saved(environment, couch_server, doc_id):
+    cache = environment.completion_cache
+    for key in doc_id_prefix_keys(couch_server, environment.current_db, doc_id):
+        cache.add(key, doc_id)
+    if is_view(doc_id):
+        cache.add(cache_key(couch_server, environment.current_db, 'view_ids'), doc_id)
+        cache.invalidate(cache_key(couch_server, environment.current_db, 'view_paths'))
+
+
+def _doc_deleted(environment, couch_server, doc_id):
+    cache = environment.completion_cache
+    for key in doc_id_prefix_keys(couch_server, environment.current_db, doc_id):
+        cache.discard(key, doc_id, complete_below=DOC_ID_COMPLETION_LIMIT)
+    if is_view(doc_id):
+        cache.discard(cache_key(couch_server, environment.current_db, 'view_ids'), doc_id)
+        cache.invalidate(cache_key(couch_server, environment.current_db, 'view_paths'))
+
+
 def json_dumps(json_object):
     return json.dumps(json_object, sort_keys=True, indent=4)
 
 
-@command_handler('ls')
+def _get_limit(environment, limit):
+    """Lower ``limit`` to the number of outputs the built-in filters of the pipe take, e.g., for ``| head 10``."""
+    output_limit = environment.output_limit
+    if limit is None:
+        return output_limit
+    return limit if output_limit is None else min(limit, output_limit)
+
+
+_LS_OPTION = r'((--limit\s+(?P<limit>[0-9]+))|(--start\s+(?P<start>[^\s]+))|(?P<doc_id_prefix>[^\s-][^\s]*))'
+
+
+@command_handler('ls', r'{0}(\s+{0})*'.format(_LS_OPTION))
 def ls(environment, couch_server, variables):
-    """ls
+    """ls [<doc_id_prefix>] [--start <doc_id>] [--limit <n>]
 
     Show the documents in the current database.
+
+    Documents are fetched page by page, so listing starts right away even on large databases.
+    With --index, the documents are listed from the local index instead.
+    Only list the ids starting with <doc_id_prefix> if given.
+    At the root, the options apply to the database names.
     """
+    limit = variables.get('limit')
     if environment.current_db is None:
         all_dbs = get_all_dbs(environment, couch_server)
-
-        for db_name in all_dbs:
-            db = couch_server[db_name]
-            info = db.info()
-            environment.output('{:>10} {}'.format(info['doc_count'], db_name))
+        if variables.get('doc_id_prefix'):
+            all_dbs = [db_name for db_name in all_dbs if db_name.startswith(variables['doc_id_prefix'])]
+        if variables.get('start'):
+            all_dbs = [db_name for db_name in all_dbs if db_name >= variables['start']]
+        limit = _get_limit(environment, int(limit) if limit else None)
+        if limit is not None:
+            all_dbs = all_dbs[:limit]
+
+        for db_name, info in iter_db_infos(environment, couch_server, all_dbs):
+            if info is not None:
+                environment.output('{:>10} {}'.format(info['doc_count'], db_name), value=info)
     else:
-        for doc in environment.current_db:
-            type_ = 'd' if not is_view(doc) else 'v'
-            environment.output('{} {}'.format(type_, doc))
+        doc_index = get_doc_index(environment)
+        list_docs = functools.partial(iter_indexed_docs, doc_index) if doc_index is not None else iter_all_docs
+        rows = list_docs(environment.current_db,
+                         prefix=variables.get('doc_id_prefix'),
+                         start=variables.get('start'),
+                         limit=_get_limit(environment, int(limit) if limit else None))
+        for row in rows:
+            type_ = 'd' if not is_view(row.id) else 'v'
+            environment.output('{} {}'.format(type_, row.id), value=dict(row.items()))
 
 
 @command_handler('cd', '(?P<database_name>[a-zA-Z0-9-_./]+)')
@@ -90,9 +391,13 @@ def cd(environment, couch_server, variables):
             environment.current_db, environment.previous_db = environment.previous_db, environment.current_db
         else:
             environment.current_db, environment.previous_db = couch_server[database_name], environment.current_db
+            environment.completion_cache.add(cache_key(couch_server, None, 'db_names'), database_name)
     except (couchdb.ResourceNotFound, couchdb.ServerError):
+        environment.completion_cache.discard(cache_key(couch_server, None, 'db_names'), database_name)
         raise RuntimeError("Database '{}' does not exist".format(database_name))
 
+    get_doc_index(environment)
+
 
 @command_handler('info')
 @require_current_db
@@ -102,64 +407,240 @@ def info(environment, couch_server, variables):
     Show the information of the current database.
     """
     info = environment.current_db.info()
-    environment.output(json_dumps(info), highlighters.json)
+    environment.output(json_dumps(info), highlighters.json, info)
+
+
+def _get_positional_args(args, options):
+    """Return the arguments in ``args`` other than ``options`` and their values.
+
+    A regex only captures the last match of a repeated group, so commands
+    taking several arguments also capture them all at once, e.g., as
+    ``rm_args``, and split them here.
+    """
+    positional_args = []
+    tokens = iter((args or '').split())
+    for token in tokens:
+        if token in options:
+            next(tokens, None)
+        elif not token.startswith('--'):
+            positional_args.append(token)
+    return positional_args
+
+
+# Every argument after a lone -- is a document id, even one that looks like an option or a glob.
+_LITERAL_DOC_IDS = r'--(\s+(?P<literal_doc_id>[^\s]+))*'
 
 
-@command_handler('cat', '(?P<doc_id>[^\s]+)')
+def _split_literal_doc_ids(args):
+    """Split ``args`` at ``--`` into the arguments before it and the literal document ids after it."""
+    tokens = (args or '').split()
+    if '--' not in tokens:
+        return args, []
+
+    i = tokens.index('--')
+    return ' '.join(tokens[:i]), tokens[i + 1:]
+
+
+def _get_doc_id_args(args, options):
+    """Return the ids and globs, and the literal ids after ``--``, among the arguments ``args``."""
+    args, literal_doc_ids = _split_literal_doc_ids(args)
+    return _get_positional_args(args, options), literal_doc_ids
+
+
+def _iter_file_doc_ids(file_name):
+    """Yield the document ids in ``file_name``, one per line, ``-`` reads them from stdin."""
+    if file_name == '-':
+        lines = sys.stdin
+    else:
+        lines = open(file_name)
+
+    try:
+        for line in lines:
+            if line.strip():
+                yield line.strip()
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+def _iter_selected_rows(environment, doc_ids, file_name, batch_size, literal_doc_ids=(), **options):
+    """Yield ``(doc_id, row)`` for the ids and globs in ``doc_ids`` and ``literal_doc_ids``, then ``file_name``."""
+    database = environment.current_db
+    globs = [doc_id for doc_id in doc_ids if is_glob(doc_id)]
+    doc_ids = [doc_id for doc_id in doc_ids if not is_glob(doc_id)] + list(literal_doc_ids)
+    if doc_ids:
+        yield from iter_doc_rows(database, doc_ids, batch_size, environment.aio, **options)
+    if file_name:
+        yield from iter_doc_rows(database, _iter_file_doc_ids(file_name), batch_size, environment.aio, **options)
+    doc_index = get_doc_index(environment) if globs else None
+    for pattern in globs:
+        yield from iter_glob_rows(database, pattern, doc_index, **options)
+
+
+_CAT_OPTION = (r'((--batch-size\s+(?P<batch_size>[0-9]+))|(--from-file\s+(?P<file_name>[^\s]+))|'
+               r'(?P<ndjson>--ndjson)|(?P<doc_id>[^\s-][^\s]*))')
+
+
+@command_handler('cat', r'(?P<cat_args>{0}(\s+{0})*(\s+{1})?|{1})'.format(_CAT_OPTION, _LITERAL_DOC_IDS))
 @require_current_db
 def cat(environment, couch_server, variables):
-    """cat <doc_id>
+    """cat <doc_id>... [--from-file <file>] [--batch-size <n>] [--ndjson] [-- <doc_id>...]
 
-    Show the content of a document by its id.
+    Show the content of documents by their ids.
+
+    Ids can be globs, e.g., session.*, and --from-file reads ids from a file, one per line (- for stdin).
+    Ids after -- are taken as they are, e.g., -a or a*b.
+    The documents are fetched <n> at a time through _all_docs, and shown one per line with --ndjson.
+    """
+    doc_ids, literal_doc_ids = _get_doc_id_args(variables.get('cat_args'), ('--batch-size', '--from-file'))
+    file_name = variables.get('file_name')
+    if not doc_ids and not literal_doc_ids and not file_name:
+        raise RuntimeError('Document not found')
+
+    batch_size = int(variables.get('batch_size') or BULK_DOCS_BATCH_SIZE)
+    ndjson = bool(variables.get('ndjson'))
+    several = file_name or len(doc_ids + literal_doc_ids) > 1 or any(map(is_glob, doc_ids))
+    found = False
+    for doc_id, row in _iter_selected_rows(environment, doc_ids, file_name, batch_size, literal_doc_ids,
+                                           include_docs=True):
+        if row is None:
+            if several and ndjson:
+                error = {'id': doc_id, 'error': 'not_found'}
+                environment.output(json.dumps(error, sort_keys=True), value=error)
+            elif several:
+                environment.output('Document not found: {}'.format(doc_id))
+        elif ndjson:
+            environment.output(json.dumps(row['doc'], sort_keys=True), value=row['doc'])
+            found = True
+        else:
+            environment.output(json_dumps(row['doc']), highlighters.json, row['doc'])
+            found = True
+
+    if not found:
+        raise RuntimeError('Document not found')
+
+
+@command_handler('stat', r'(?P<doc_id>[^\s]+)')
+@require_current_db
+def stat(environment, couch_server, variables):
+    """stat <doc_id>
+
+    Show the revision and size of a document without fetching it.
     """
     doc_id = variables.get('doc_id')
     if not doc_id:
         raise RuntimeError('Document not found')
 
-    doc = environment.current_db.get(doc_id)
-    if not doc:
+    doc_stat = stat_doc(environment.current_db, doc_id)
+    if doc_stat is None:
         raise RuntimeError('Document not found')
 
-    environment.output(json_dumps(doc), highlighters.json)
+    doc_stat = dict(doc_stat._asdict())
+    environment.output(json_dumps(doc_stat), highlighters.json, doc_stat)
+
 
+_RM_OPTION = (r'((--batch-size\s+(?P<batch_size>[0-9]+))|(--from-file\s+(?P<file_name>[^\s]+))|'
+              r'(?P<doc_id>[^\s-][^\s]*))')
 
-@command_handler('rm', '(?P<doc_id>[^\s]+)')
+
+@command_handler('rm', r'(?P<rm_args>{0}(\s+{0})*(\s+{1})?|{1})'.format(_RM_OPTION, _LITERAL_DOC_IDS))
 @require_current_db
 def rm(environment, couch_server, variables):
-    """rm <doc_id>
+    """rm <doc_id>... [--from-file <file>] [--batch-size <n>] [-- <doc_id>...]
+
+    Removes the documents by their ids.
 
-    Removes the document by its id.
+    Ids can be globs, e.g., session.*, and --from-file reads ids from a file, one per line (- for stdin).
+    Ids after -- are taken as they are, e.g., -a or a*b.
+    The documents are deleted <n> at a time through _bulk_docs.
     """
-    doc_id = variables.get('doc_id')
-    if not doc_id:
+    doc_ids, literal_doc_ids = _get_doc_id_args(variables.get('rm_args'), ('--batch-size', '--from-file'))
+    file_name = variables.get('file_name')
+    if not doc_ids and not literal_doc_ids and not file_name:
         raise RuntimeError('Document not found')
 
-    doc = environment.current_db.get(doc_id)
-    if not doc:
+    batch_size = int(variables.get('batch_size') or BULK_DOCS_BATCH_SIZE)
+    show_progress = file_name or len(doc_ids + literal_doc_ids) > 1 or any(map(is_glob, doc_ids))
+    rows = _iter_selected_rows(environment, doc_ids, file_name, batch_size, literal_doc_ids)
+
+    deleted, failed = 0, 0
+    for batch in iter_batches(rows, batch_size):
+        docs = []
+        for doc_id, row in batch:
+            if row is None:
+                if show_progress:
+                    environment.output('Document not found: {}'.format(doc_id))
+            else:
+                docs.append({'_id': doc_id, '_rev': row.value['rev'], '_deleted': True})
+
+        for success, doc_id, result in environment.current_db.update(docs) if docs else []:
+            if success:
+                deleted += 1
+                _doc_deleted(environment, couch_server, doc_id)
+                if not show_progress:
+                    environment.output('Deleted document {} '.format(doc_id))
+            else:
+                failed += 1
+                environment.output('Unable to delete {}: {}'.format(doc_id, result))
+
+        if show_progress:
+            environment.output('Deleted {} documents'.format(deleted))
+
+    if not deleted and not failed:
         raise RuntimeError('Document not found')
+    if failed:
+        raise RuntimeError('Unable to delete {} documents'.format(failed))
 
-    environment.current_db.delete(doc)
 
-    environment.output('Deleted document {} '.format(doc_id))
+def _parse_view_key(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
 
+_EXEC_OPTION = (r'(--limit\s+(?P<limit>[0-9]+))|(--skip\s+(?P<skip>[0-9]+))|'
+                r'(--key\s+(?P<key>[^\s]+))|(--startkey\s+(?P<startkey>[^\s]+))|(--endkey\s+(?P<endkey>[^\s]+))|'
+                r'(?P<descending>--descending)|(?P<include_docs>--include-docs)')
 
-@command_handler('exec', '(?P<view_path>[^\s]+)')
+
+@command_handler('exec', r'(?P<view_path>[^\s-][^\s]*)(\s+({}))*'.format(_EXEC_OPTION))
 @require_current_db
 def exec_(environment, couch_server, variables):
-    """exec <view_path>
+    """exec <view_path> [--limit <n>] [--skip <n>] [--key <key>] [--startkey <key>] [--endkey <key>]
+                        [--descending] [--include-docs]
 
     Execute the view given the full view path.
+
+    Keys are JSON values, e.g., ["smith",42]; anything that isn't valid JSON is taken as a string.
+    Rows are fetched page by page, so the first rows show up right away even on large views.
     """
-    view_path = variables.get('view_path')
+    view_path = variables.get('view_path') or ''
     if ':' not in view_path:
         raise RuntimeError('Invalid view_path. Must be of the form: view_doc_id:view_name')
     view_id, view_name = view_path.split(':', 1)
     if not view_id:
         raise RuntimeError('View not found')
 
+    options = {}
+    if variables.get('skip'):
+        options['skip'] = int(variables.get('skip'))
+    limit = _get_limit(environment, int(variables.get('limit')) if variables.get('limit') else None)
+    if limit is not None:
+        options['limit'] = limit
+    for option in ('key', 'startkey', 'endkey'):
+        if variables.get(option):
+            options[option] = _parse_view_key(variables.get(option))
+    for option in ('descending', 'include_docs'):
+        if variables.get(option):
+            options[option] = True
+
     try:
-        for result in environment.current_db.view('{}/_view/{}'.format(view_id, view_name)):
-            environment.output(json_dumps(dict(result.items())), highlighters.json)
+        for result in iter_view(environment.current_db, '{}/_view/{}'.format(view_id, view_name), **options):
+            result = dict(result.items())
+            environment.output(json_dumps(result), highlighters.json, result)
+    except PipeClosed:
+        raise
     except:
         traceback.print_exc()
         raise RuntimeError('Unable to exec view: {}'.format(view_id))
@@ -180,24 +661,16 @@ def mkdir(environment, couch_server, variables):
         raise RuntimeError('Database {} already exists'.format(database_name))
 
     try:
-        couch_server.create(database_name)
+        database = couch_server.create(database_name)
     except couchdb.Unauthorized as e:
         raise RuntimeError(str(e))
+    if environment.doc_index is not None:
+        environment.doc_index.forget(database)  # in case a database of the same name was indexed before
+    environment.completion_cache.add(cache_key(couch_server, None, 'db_names'), database_name)
     environment.output('Created {}'.format(database_name))
 
 
-@command_handler('lv', '(?P<view_doc_id>[a-zA-Z0-9-_/]+)')
-@require_current_db
-def lv(environment, couch_server, variables):
-    """lv <view_doc_id>
-
-    Show the views inside the view document.
-    """
-    view_doc_id = variables['view_doc_id']
-    if view_doc_id not in environment.current_db:
-        raise RuntimeError('{} not found'.format(view_doc_id))
-
-    view_doc = environment.current_db[view_doc_id]
+def _output_views(environment, view_doc):
     language = view_doc.get('language', 'javascript')
 
     highlighter = {
@@ -206,19 +679,38 @@ def lv(environment, couch_server, variables):
         'erlang': highlighters.erlang,
     }.get(language, lambda x: x)
 
-    views = view_doc.get('views')
-
-    if not views:
-        raise RuntimeError("The design doc {} doesn't have any views".format(view_doc_id))
-
-    for view_name, view_funcs in views.items():
-        environment.output('{}:{}'.format(view_doc_id, view_name))
+    for view_name, view_funcs in view_doc.get('views', {}).items():
+        environment.output('{}:{}'.format(view_doc.id, view_name))
         map_func = view_funcs.get('map', '')
         reduce_func = view_funcs.get('reduce', '')
         environment.output(highlighter(map_func))
         environment.output(highlighter(reduce_func))
 
 
+@command_handler('lv', '(?P<view_doc_id>[a-zA-Z0-9-_/]+)')
+@require_current_db
+def lv(environment, couch_server, variables):
+    """lv [<view_doc_id>]
+
+    Show the views inside the view document.
+    Show the views inside all the view documents if no <view_doc_id> is given.
+    """
+    view_doc_id = variables.get('view_doc_id')
+    if not view_doc_id:
+        for view_doc in get_design_docs(environment.current_db):
+            _output_views(environment, view_doc)
+        return
+
+    view_doc = environment.current_db.get(view_doc_id)
+    if view_doc is None:
+        raise RuntimeError('{} not found'.format(view_doc_id))
+
+    if not view_doc.get('views'):
+        raise RuntimeError("The design doc {} doesn't have any views".format(view_doc_id))
+
+    _output_views(environment, view_doc)
+
+
 @command_handler('man', pattern='(?P<target>[a-zA-Z0-9-_]*)', aliases=['help'])
 def man(environment, couch_server, variables):
     """man <command>
@@ -270,19 +762,19 @@ def du(environment, couch_server, variables):
 
     Shows the number of documents and amount of disk space they take up.
     """
-    databases = [environment.current_db]
-
-    if not environment.current_db:
-        db_names = couch_server.resource.get_json('_all_dbs')[2]
-        databases = [couch_server[db] for db in db_names]
+    if environment.current_db:
+        db_infos = [(environment.current_db.name, environment.current_db.info())]
+    else:
+        db_infos = iter_db_infos(environment, couch_server, get_all_dbs(environment, couch_server))
 
-    for database in databases:
-        db_info = database.info()
+    for db_name, db_info in db_infos:
+        if db_info is None:
+            continue
 
         # Refer to http://docs.couchdb.org/en/latest/api/database/common.html#get--db
         docs_in_db = db_info['doc_count']
         total_usage = _convert_bytes_to_human_readable(db_info['disk_size'])
-        environment.output('{:<16}{:<24}({} documents)'.format(total_usage, database.name, docs_in_db))
+        environment.output('{:<16}{:<24}({} documents)'.format(total_usage, db_name, docs_in_db))
 
     environment.output('')
 
@@ -310,11 +802,11 @@ def edit(environment, couch_server, variables):
     Note: it doesn't matter which command you use, vi, emacs or ed, it will only use your $EDITOR
     """
     doc_id = variables.get('doc_id')
-    mode = 'create' if doc_id not in environment.current_db else 'edit'
+    doc = environment.current_db.get(doc_id)
+    mode = 'create' if doc is None else 'edit'
 
     _, file_path = tempfile.mkstemp('.json')
     if mode == 'edit':
-        doc = environment.current_db[doc_id]
         safe_doc = dict(doc)
         safe_doc.pop('_rev', None)
         safe_doc.pop('_id', None)
@@ -339,6 +831,8 @@ def edit(environment, couch_server, variables):
     except Exception as e:
         raise RuntimeError(str(e))
 
+    _doc_saved(environment, couch_server, doc_id)
+
 
 @command_handler('touch', pattern='(?P<doc_id>[^\s]+)')
 @require_current_db
@@ -355,3 +849,556 @@ def touch(environment, couch_server, variables):
 
     doc = {'_id': doc_id}
     environment.current_db.save(doc)
+    _doc_saved(environment, couch_server, doc_id)
+
+
+DUMP_PAGE_SIZE = 2000
+_DUMP_READ_SIZE = 64 * 1024
+
+
+def _open_dump(file_name, mode, compress):
+    return gzip.open(file_name, mode) if compress else open(file_name, mode)
+
+
+def _get_last_dumped_id(file_name, compress):
+    """Return the id of the last document written to the dump ``file_name``, ``None`` if there's none.
+
+    A partially written last line is cut off an uncompressed dump, so the
+    dump can be appended to.
+    """
+    if not os.path.exists(file_name):
+        return None
+
+    if compress:
+        last_line = None
+        try:
+            with gzip.open(file_name, 'rb') as f:
+                for line in f:
+                    if line.endswith(b'\n'):
+                        last_line = line
+        except EOFError:
+            raise RuntimeError('Unable to resume, {} is truncated'.format(file_name))
+    else:
+        with open(file_name, 'rb+') as f:
+            end = position = f.seek(0, io.SEEK_END)
+            tail = b''
+            lines = [tail]
+            # read backwards until the last complete line is found
+            while position > 0 and len(lines) < 3:
+                size = min(position, _DUMP_READ_SIZE)
+                position -= size
+                f.seek(position)
+                tail = f.read(size) + tail
+                lines = tail.split(b'\n')
+            if lines[-1]:
+                f.truncate(end - len(lines[-1]))
+            last_line = lines[-2] if len(lines) >= 2 else None
+
+    return json.loads(last_line.decode('utf-8'))['_id'] if last_line else None
+
+
+def dump_database(database, file_name, compress=None, attachments=False, resume=False, page_size=None):
+    """Write every document of ``database`` to ``file_name``, one JSON document per line.
+
+    The documents are fetched a page at a time through ``_all_docs`` and
+    written out before the next page is fetched, so the memory in use
+    doesn't depend on the size of the database.
+
+    :param compress: gzip the dump, defaults to whether ``file_name`` ends with ``.gz``
+    :param attachments: include the attachments inline, rather than their stubs
+    :param resume: append the documents after the last one already in ``file_name``
+    :param page_size: the number of documents to fetch per request
+    :return: the number of documents written
+    """
+    if compress is None:
+        compress = file_name.endswith('.gz')
+
+    last_id = _get_last_dumped_id(file_name, compress) if resume else None
+    options = {'include_docs': True}
+    if attachments:
+        options['attachments'] = True
+
+    rows = iter_all_docs(database, start=last_id, page_size=page_size or DUMP_PAGE_SIZE, **options)
+    count = 0
+    with _open_dump(file_name, 'ab' if resume else 'wb', compress) as f:
+        for page in iter_batches(rows, page_size or DUMP_PAGE_SIZE):
+            lines = [json.dumps(row['doc'], sort_keys=True) for row in page if row.id != last_id]
+            if lines:
+                f.write('{}\n'.format('\n'.join(lines)).encode('utf-8'))
+            count += len(lines)
+    return count
+
+
+_DUMP_OPTION = (r'(?P<gzip>--gzip)|(?P<attachments>--attachments)|(?P<resume>--resume)|'
+                r'(--page-size\s+(?P<page_size>[0-9]+))')
+
+
+@command_handler('dump', r'(?P<file_name>[^\s-][^\s]*)(\s+({}))*'.format(_DUMP_OPTION))
+@require_current_db
+def dump(environment, couch_server, variables):
+    """dump <file> [--gzip] [--attachments] [--resume] [--page-size <n>]
+
+    Export all the documents of the current database to <file>, one JSON document per line.
+
+    The dump is gzipped with --gzip or when <file> ends with .gz.
+    Attachments are included inline with --attachments, otherwise only their stubs are.
+    --resume continues an interrupted dump after the last document in <file>.
+    """
+    file_name = variables.get('file_name')
+    if not file_name:
+        raise RuntimeError('Must specify a file')
+
+    page_size = variables.get('page_size')
+    try:
+        count = dump_database(environment.current_db, file_name,
+                              compress=True if variables.get('gzip') else None,
+                              attachments=bool(variables.get('attachments')),
+                              resume=bool(variables.get('resume')),
+                              page_size=int(page_size) if page_size else None)
+    except (IOError, OSError) as e:
+        raise RuntimeError(str(e))
+
+    environment.output('Dumped {} documents to {}'.format(count, file_name))
+
+
+LOAD_CONCURRENCY = 4
+# Larger documents are taken for malformed input, rather than read on into memory.
+LOAD_MAX_DOC_SIZE = 64 * 1024 * 1024
+_LOAD_READ_SIZE = 64 * 1024
+_JSON_SEPARATOR_RE = re.compile(r'[\s,]*')
+
+
+def _invalid_json(buffer, position, line):
+    line_start = buffer.rfind('\n', 0, position) + 1
+    text = buffer[line_start:line_start + 80].split('\n')[0]
+    return RuntimeError('Invalid JSON on line {}: {}'.format(line + buffer.count('\n', 0, position), text))
+
+
+def iter_json_docs(f, read_size=None, max_doc_size=None):
+    """Yield the documents read from ``f``, either one JSON document per line or a JSON array of documents.
+
+    ``f`` is read a chunk at a time, so the whole input is never held in memory.
+    Malformed input fails as soon as the line it's on is read.
+
+    :param max_doc_size: the size in characters of the largest document to read
+    """
+    read_size = size = read_size or _LOAD_READ_SIZE
+    max_doc_size = max_doc_size or LOAD_MAX_DOC_SIZE
+    decoder = json.JSONDecoder()
+    buffer, position, started, line = '', 0, False, 1
+    while True:
+        position = _JSON_SEPARATOR_RE.match(buffer, position).end()
+        if not started and position < len(buffer):
+            started = True
+            if buffer[position] == '[':
+                position += 1
+                continue
+        if position < len(buffer) and buffer[position] == ']':
+            return
+
+        try:
+            doc, position = decoder.raw_decode(buffer, position)
+        except ValueError as e:
+            # values can't span lines, only the whitespace between them, so an error before a new line is final
+            if '\n' in buffer[e.pos:]:
+                raise _invalid_json(buffer, e.pos, line)
+            if len(buffer) - position > max_doc_size:
+                raise RuntimeError('Document on line {} is larger than {} characters'.format(
+                    line + buffer.count('\n', 0, position), max_doc_size))
+
+            # the document is incomplete, read on, more at a time for large documents
+            chunk = f.read(size)
+            if not chunk:
+                if position < len(buffer):
+                    raise _invalid_json(buffer, position, line)
+                return
+            line += buffer.count('\n', 0, position)
+            buffer, position, size = buffer[position:] + chunk, 0, size * 2
+            continue
+
+        size = read_size
+        if not isinstance(doc, dict):
+            raise RuntimeError('Not a JSON document: {}'.format(json.dumps(doc)[:80]))
+        yield doc
+
+
+def bulk_docs(database, docs, **options):
+    """Save ``docs`` with a single ``_bulk_docs`` request and return its results.
+
+    :param options: the request options, e.g., ``new_edits``
+    """
+    body = dict(options)
+    body['docs'] = docs
+    _, _, results = database.resource.post_json('_bulk_docs', body=body)
+    return results
+
+
+def iter_bulk_docs(database, docs, batch_size=None, concurrency=None, **options):
+    """Save ``docs`` ``batch_size`` at a time through ``_bulk_docs``, with up to ``concurrency`` requests at once.
+
+    Yield ``(batch, results)`` for every batch, in order. Only ``concurrency``
+    batches are in flight, so ``docs`` is consumed as fast as it's saved.
+    """
+    concurrency = concurrency or LOAD_CONCURRENCY
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        in_flight = deque()
+        for batch in iter_batches(docs, batch_size or BULK_DOCS_BATCH_SIZE):
+            if len(in_flight) == concurrency:
+                done_batch, future = in_flight.popleft()
+                yield done_batch, future.result()
+            in_flight.append((batch, executor.submit(bulk_docs, database, batch, **options)))
+
+        while in_flight:
+            done_batch, future = in_flight.popleft()
+            yield done_batch, future.result()
+
+
+def _output_bulk_docs(environment, batches):
+    """Report the results of every batch from :func:`iter_bulk_docs`, return the number of documents saved."""
+    started_at = time.monotonic()
+    saved = 0
+    for i, (batch, results) in enumerate(batches, 1):
+        errors = [result.get('error') for result in results if 'error' in result]
+        conflicts = errors.count('conflict')
+        saved += len(batch) - len(errors)
+        environment.output('Batch {}: {} saved, {} conflicts, {} errors ({:.0f} docs/s)'.format(
+            i, len(batch) - len(errors), conflicts, len(errors) - conflicts,
+            saved / max(time.monotonic() - started_at, 1e-6)))
+    return saved
+
+
+def _iter_loaded_docs(f, keep_rev):
+    for doc in iter_json_docs(f):
+        if not keep_rev:
+            doc.pop('_rev', None)
+        yield doc
+
+
+def _open_load(file_name):
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rt', encoding='utf-8')
+    return io.open(file_name, 'r', encoding='utf-8')
+
+
+_LOAD_OPTION = (r'(--batch-size\s+(?P<batch_size>[0-9]+))|(--concurrency\s+(?P<concurrency>[0-9]+))|'
+                r'(?P<keep_rev>--keep-rev)')
+
+
+@command_handler('load', r'(?P<file_name>-|[^\s-][^\s]*)(\s+({}))*'.format(_LOAD_OPTION))
+@require_current_db
+def load(environment, couch_server, variables):
+    """load <file> [--batch-size <n>] [--concurrency <n>] [--keep-rev]
+
+    Import documents into the current database from <file> (- for stdin), e.g., made by dump.
+
+    <file> holds one JSON document per line or a JSON array of documents, and is read gzipped if it ends with .gz.
+    The documents are saved <n> at a time through _bulk_docs, over --concurrency connections at once.
+    _rev is dropped unless --keep-rev is given, which stores the revisions as they are, like replication does.
+    """
+    file_name = variables.get('file_name')
+    if not file_name:
+        raise RuntimeError('Must specify a file')
+
+    keep_rev = bool(variables.get('keep_rev'))
+    options = {'new_edits': False} if keep_rev else {}
+    batch_size = variables.get('batch_size')
+    concurrency = variables.get('concurrency')
+
+    started_at = time.monotonic()
+    f = None
+    try:
+        f = sys.stdin if file_name == '-' else _open_load(file_name)
+        batches = iter_bulk_docs(environment.current_db, _iter_loaded_docs(f, keep_rev),
+                                 batch_size=int(batch_size) if batch_size else None,
+                                 concurrency=int(concurrency) if concurrency else None, **options)
+        saved = _output_bulk_docs(environment, batches)
+    except (IOError, OSError) as e:
+        raise RuntimeError(str(e))
+    finally:
+        if f is not None and f is not sys.stdin:
+            f.close()
+        environment.completion_cache.invalidate_prefix(cache_key(couch_server, environment.current_db, None)[:2])
+
+    environment.output('Loaded {} documents in {:.1f}s'.format(saved, time.monotonic() - started_at))
+
+
+FIND_PAGE_SIZE = 1000
+
+
+def iter_find(database, selector, page_size=None, limit=None, **query):
+    """Iterate the documents matching a Mango ``selector`` one page at a time, following the bookmarks.
+
+    :param database: the database to search
+    :param selector: the selector, e.g., ``{"type": "user"}``
+    :param page_size: the number of documents to fetch per request
+    :param limit: the maximum number of documents to yield
+    :param query: the other ``_find`` parameters, e.g., ``fields``, ``sort`` or ``use_index``
+    """
+    page_size = page_size or FIND_PAGE_SIZE
+    body = dict(query, selector=selector)
+    while limit is None or limit > 0:
+        body['limit'] = page_size if limit is None else min(page_size, limit)
+        _, _, result = database.resource.post_json('_find', body=body)
+        docs = result.get('docs', [])
+        for doc in docs:
+            yield doc
+
+        if len(docs) < body['limit'] or not result.get('bookmark'):
+            return
+        if limit is not None:
+            limit -= len(docs)
+        body['bookmark'] = result['bookmark']
+
+
+def _replication_endpoint(couch_server, database_name):
+    resource = couch_server.resource(database_name)
+    if not resource.credentials:
+        return resource.url
+    return {'url': resource.url, 'headers': {'Authorization': couchdb.http.basic_auth(resource.credentials).decode()}}
+
+
+def _iter_copied_docs(source_db, prefix, selector, batch_size):
+    options = {'include_docs': True, 'attachments': True}
+    if selector is not None:
+        doc_ids = (doc['_id'] for doc in iter_find(source_db, selector, page_size=batch_size, fields=['_id']))
+        rows = (row for _, row in iter_doc_rows(source_db, doc_ids, batch_size, **options) if row is not None)
+    else:
+        rows = iter_all_docs(source_db, prefix=prefix, page_size=batch_size, **options)
+
+    for row in rows:
+        yield row['doc']
+
+
+def _copy_database(environment, couch_server, variables):
+    source, target = variables.get('source'), variables.get('destination')
+    prefix, selector = variables.get('prefix'), variables.get('selector')
+    if not prefix and not selector:
+        result = couch_server.replicate(_replication_endpoint(couch_server, source),
+                                        _replication_endpoint(couch_server, target), create_target=True)
+        environment.completion_cache.add(cache_key(couch_server, None, 'db_names'), target)
+        history = result.get('history') or [{}]
+        docs_written = result.get('docs_written', history[0].get('docs_written', 0))
+        environment.output('Copied {} to {} ({} documents written)'.format(source, target, docs_written))
+        return
+
+    if selector:
+        try:
+            selector = json.loads(selector)
+        except ValueError:
+            raise RuntimeError('Invalid selector: {}'.format(selector))
+
+    source_db = couch_server[source]
+    try:
+        target_db = couch_server[target]
+    except couchdb.ResourceNotFound:
+        target_db = couch_server.create(target)
+        environment.completion_cache.add(cache_key(couch_server, None, 'db_names'), target)
+
+    batch_size = int(variables.get('batch_size') or BULK_DOCS_BATCH_SIZE)
+    concurrency = variables.get('concurrency')
+    batches = iter_bulk_docs(target_db, _iter_copied_docs(source_db, prefix, selector, batch_size),
+                             batch_size=batch_size, concurrency=int(concurrency) if concurrency else None,
+                             new_edits=False)
+    copied = _output_bulk_docs(environment, batches)
+    environment.completion_cache.invalidate_prefix(cache_key(couch_server, target, None)[:2])
+    environment.output('Copied {} documents from {} to {}'.format(copied, source, target))
+
+
+def _copy_doc(environment, couch_server, variables):
+    source, destination = variables.get('source'), variables.get('destination')
+    if variables.get('prefix') or variables.get('selector'):
+        raise RuntimeError('--prefix and --selector only apply to copying databases, from /')
+
+    environment.current_db.copy(source, destination)
+    _doc_saved(environment, couch_server, destination)
+    environment.output('Copied {} to {}'.format(source, destination))
+
+
+# a JSON object, which may contain spaces, up to the next option
+_SELECTOR_PATTERN = r'\{([^\s]|\s(?!\s*--))*\}'
+
+_CP_OPTION = (r'(--prefix\s+(?P<prefix>[^\s]+))|(--selector\s+(?P<selector>' + _SELECTOR_PATTERN + r'))|'
+              r'(--batch-size\s+(?P<batch_size>[0-9]+))|(--concurrency\s+(?P<concurrency>[0-9]+))')
+
+
+@command_handler('cp', r'(?P<source>[^\s-][^\s]*)\s+(?P<destination>[^\s-][^\s]*)(\s+({}))*'.format(_CP_OPTION))
+def cp(environment, couch_server, variables):
+    """cp <source> <destination> [--prefix <doc_id_prefix>] [--selector <selector>]
+                                 [--batch-size <n>] [--concurrency <n>]
+
+    Copy a database from /, or a document inside a database.
+
+    Databases are copied by the server through _replicate, creating <destination> if needed.
+    With --prefix or a Mango --selector, e.g., '{"type": "user"}', only the matching documents are copied,
+    read a page at a time and saved <n> at a time through _bulk_docs, over --concurrency connections.
+    """
+    if not variables.get('source') or not variables.get('destination'):
+        raise RuntimeError('Must specify a source and a destination')
+
+    try:
+        if environment.current_db is None:
+            _copy_database(environment, couch_server, variables)
+        else:
+            _copy_doc(environment, couch_server, variables)
+    except couchdb.ResourceNotFound:
+        raise RuntimeError('{} not found'.format(variables.get('source')))
+    except couchdb.ResourceConflict:
+        raise RuntimeError('{} already exists'.format(variables.get('destination')))
+
+
+def _parse_sort(sort):
+    """Parse ``field[:asc|desc],...`` into the ``sort`` of ``_find``."""
+    fields = []
+    for field in sort.split(','):
+        name, _, direction = field.partition(':')
+        if direction not in ('', 'asc', 'desc'):
+            raise RuntimeError('Invalid sort direction: {}'.format(direction))
+        fields.append({name: direction or 'asc'})
+    return fields
+
+
+_FIND_OPTION = (r'(--fields\s+(?P<fields>[^\s]+))|(--sort\s+(?P<sort>[^\s]+))|(--limit\s+(?P<limit>[0-9]+))|'
+                r'(--use-index\s+(?P<use_index>[^\s]+))|(--page-size\s+(?P<page_size>[0-9]+))')
+
+
+@command_handler('find', r'(?P<selector>{})(\s+({}))*'.format(_SELECTOR_PATTERN, _FIND_OPTION))
+@require_current_db
+def find(environment, couch_server, variables):
+    """find <selector> [--fields <field>,...] [--sort <field>[:desc],...] [--limit <n>] [--use-index <index>]
+                       [--page-size <n>]
+
+    Show the documents matching a Mango selector, e.g., find '{"type": "user", "age": {"$gt": 21}}'
+
+    The query runs on the server through _find, and the results are fetched <n> at a time, following the bookmarks.
+    Field names are completed from a sample of the documents.
+    """
+    try:
+        selector = json.loads(variables.get('selector') or '')
+    except ValueError:
+        raise RuntimeError('Invalid selector: {}'.format(variables.get('selector')))
+
+    query = {}
+    if variables.get('fields'):
+        query['fields'] = variables.get('fields').split(',')
+    if variables.get('sort'):
+        query['sort'] = _parse_sort(variables.get('sort'))
+    if variables.get('use_index'):
+        query['use_index'] = variables.get('use_index')
+    limit = _get_limit(environment, int(variables.get('limit')) if variables.get('limit') else None)
+    page_size = variables.get('page_size')
+
+    try:
+        for doc in iter_find(environment.current_db, selector, page_size=int(page_size) if page_size else None,
+                             limit=limit, **query):
+            environment.output(json_dumps(doc), highlighters.json, doc)
+    except couchdb.ServerError as e:
+        _, (_, reason) = e.args[0]
+        raise RuntimeError(reason)
+
+
+TAIL_SIZE = 10
+CHANGES_PAGE_SIZE = 1000
+CHANGES_HEARTBEAT = 10
+CHANGES_RECONNECT_DELAY = 1
+
+
+def iter_changes(database, since=0, page_size=None, **options):
+    """Iterate the changes of ``database`` after ``since`` one page at a time, up to the latest one.
+
+    :param options: the ``_changes`` options, e.g., ``filter`` or ``include_docs``
+    """
+    page_size = page_size or CHANGES_PAGE_SIZE
+    while True:
+        result = database.changes(since=since, limit=page_size, **options)
+        for change in result['results']:
+            yield change
+
+        if len(result['results']) < page_size:
+            return
+        since = result['last_seq']
+
+
+def _open_feed_database(database, timeout):
+    """Return ``database`` on a session of its own, which gives up on reading after ``timeout`` seconds."""
+    session = database.resource.session
+    if isinstance(session, Session):
+        session = session.copy(pool_size=1, read_timeout=timeout)
+    else:
+        session = Session(pool_size=1, read_timeout=timeout)
+    feed_database = couchdb.Database(database.resource.url, session=session)
+    feed_database.resource.credentials = database.resource.credentials
+    return feed_database
+
+
+def follow_changes(database, since='now', heartbeat=None, reconnect_delay=None, **options):
+    """Iterate the continuous feed of changes of ``database``, forever.
+
+    The server sends a heartbeat every ``heartbeat`` seconds, so a connection
+    that stays silent for longer is dead. The feed then reconnects from the
+    last change seen.
+
+    :param options: the ``_changes`` options, e.g., ``filter`` or ``include_docs``
+    """
+    heartbeat = heartbeat or CHANGES_HEARTBEAT
+    if since == 'now':
+        since = database.info()['update_seq']
+
+    feed_database = _open_feed_database(database, heartbeat * 3)
+    while True:
+        try:
+            for change in feed_database.changes(feed='continuous', since=since, heartbeat=heartbeat * 1000,
+                                                **options):
+                if 'last_seq' in change:
+                    since = change['last_seq']
+                    break
+                since = change['seq']
+                yield change
+        except (IOError, OSError, http.client.HTTPException):
+            time.sleep(reconnect_delay or CHANGES_RECONNECT_DELAY)
+
+
+def _iter_last_changes(database, **options):
+    changes = database.changes(descending=True, limit=TAIL_SIZE, **options)['results']
+    return reversed(changes)
+
+
+_TAIL_OPTION = (r'(?P<follow>-f)|(--since\s+(?P<since>[^\s]+))|(--filter\s+(?P<filter>[^\s]+))|'
+                r'(?P<include_docs>--include-docs)')
+
+
+@command_handler('tail', r'({0})(\s+({0}))*'.format(_TAIL_OPTION))
+@require_current_db
+def tail(environment, couch_server, variables):
+    """tail [-f] [--since now|<seq>] [--filter <design_doc>/<filter>] [--include-docs]
+
+    Show the changes of the current database, one per line.
+
+    Show the last changes, or all the changes after --since <seq>.
+    With -f, keep showing the changes as they happen, after --since (now by default), until Ctrl+C.
+    """
+    options = {}
+    if variables.get('filter'):
+        options['filter'] = variables.get('filter')
+    if variables.get('include_docs'):
+        options['include_docs'] = True
+
+    since = variables.get('since')
+    if variables.get('follow'):
+        changes = follow_changes(environment.current_db, since=since or 'now', **options)
+    elif since:
+        changes = iter_changes(environment.current_db, since=since, **options)
+    else:
+        changes = _iter_last_changes(environment.current_db, **options)
+
+    try:
+        for change in changes:
+            environment.output(json.dumps(change, sort_keys=True), highlighters.json, change)
+            if variables.get('follow'):
+                environment.flush()  # show the change right away, the next one may take a while
+    except KeyboardInterrupt:
+        pass
+    except couchdb.ResourceNotFound:
+        raise RuntimeError('Filter not found: {}'.format(variables.get('filter')))
+    except couchdb.ServerError as e:
+        _, (_, reason) = e.args[0]
+        raise RuntimeError(reason)
@@ -1,8 +1,11 @@
 import functools
+import re
 
 from prompt_toolkit.contrib.regular_languages.completion import GrammarCompleter
 from .grammar import grammar
-from .commands import COMMANDS, get_all_dbs, is_view
+from .cache import DOC_ID_COMPLETION_LIMIT, cache_key
+from .commands import COMMANDS, get_all_dbs, get_design_docs, get_doc_index, is_view, iter_all_docs, iter_indexed_docs
+from .index import REFRESH_INTERVAL
 
 # {{{ See https://github.com/jonathanslenders/python-prompt-toolkit/pull/344
 # I modified this class to support context-aware auto-complete word list
@@ -72,6 +75,57 @@ class WordCompleter(Completer):  # pragma: nocover
 # }}}
 
 
+class DocIdCompleter(Completer):
+    """Autocompletion of document ids, fetched for the text typed so far.
+
+    :param fetch_doc_ids: A callable which takes the typed prefix and returns the matching document ids.
+    """
+    def __init__(self, fetch_doc_ids):
+        self.fetch_doc_ids = fetch_doc_ids
+
+    def get_completions(self, document, complete_event):
+        prefix = document.text_before_cursor
+        for doc_id in self.fetch_doc_ids(prefix):
+            if doc_id.startswith(prefix):
+                yield Completion(doc_id, -len(prefix))
+
+
+class FieldNameCompleter(Completer):
+    """Autocompletion of field names, inside a selector or in a comma separated list of fields.
+
+    :param fetch_field_names: A callable which returns the field names.
+    :param in_selector: Whether the completed text is a selector, e.g., ``{"name": "john", "ag``.
+    """
+    _SELECTOR_FIELD_RE = re.compile(r'(?:^|[{,])\s*"([^"]*)$')
+    _LIST_FIELD_RE = re.compile(r'(?:^|,)([^,:]*)$')
+
+    def __init__(self, fetch_field_names, in_selector=False):
+        self.fetch_field_names = fetch_field_names
+        self.pattern = self._SELECTOR_FIELD_RE if in_selector else self._LIST_FIELD_RE
+
+    def get_completions(self, document, complete_event):
+        m = self.pattern.search(document.text_before_cursor)
+        if not m:
+            return
+
+        prefix = m.group(1)
+        for field_name in self.fetch_field_names():
+            if field_name.startswith(prefix):
+                yield Completion(field_name, -len(prefix))
+
+
+class CurrentDbCompleter(Completer):
+    """Autocompletion with ``root_completer`` from /, and with ``db_completer`` inside a database."""
+    def __init__(self, environment, root_completer, db_completer):
+        self.environment = environment
+        self.root_completer = root_completer
+        self.db_completer = db_completer
+
+    def get_completions(self, document, complete_event):
+        completer = self.root_completer if self.environment.current_db is None else self.db_completer
+        return completer.get_completions(document, complete_event)
+
+
 def fetch_db_names(environment, couch_server):
     try:
         return get_all_dbs(environment, couch_server)
@@ -79,42 +133,135 @@ def fetch_db_names(environment, couch_server):
         return []
 
 
-def fetch_doc_ids(environment, couch_server):
+def _get_doc_index(environment):
+    return get_doc_index(environment, max_age=REFRESH_INTERVAL)
+
+
+def fetch_doc_ids(environment, couch_server, prefix=''):
+    if environment.current_db is None:
+        return []
+
+    doc_index = _get_doc_index(environment)
+    if doc_index is not None:
+        rows = iter_indexed_docs(doc_index, environment.current_db, prefix=prefix, limit=DOC_ID_COMPLETION_LIMIT)
+    else:
+        rows = iter_all_docs(environment.current_db, prefix=prefix, limit=DOC_ID_COMPLETION_LIMIT)
+    return [row.id for row in rows]
+
+
+def fetch_cached_doc_ids(environment, couch_server, prefix=''):
+    """Fetch the doc ids starting with ``prefix`` through the environment's completion cache.
+
+    Only up to ``DOC_ID_COMPLETION_LIMIT`` ids are fetched per prefix. When a
+    shorter prefix has already been fetched in full, its ids are filtered
+    instead of asking the server again. The cache is skipped when the ids
+    come from the local index.
+    """
     if environment.current_db is None:
         return []
+    if environment.doc_index is not None:
+        return fetch_doc_ids(environment, couch_server, prefix)
+
+    cache = environment.completion_cache
+    for i in range(len(prefix) - 1, -1, -1):
+        doc_ids = cache.lookup(cache_key(couch_server, environment.current_db, ('doc_ids', prefix[:i])))
+        if doc_ids is None:
+            continue
+        if len(doc_ids) < DOC_ID_COMPLETION_LIMIT:
+            return [doc_id for doc_id in doc_ids if doc_id.startswith(prefix)]
+        break
 
-    return list(environment.current_db)
+    key = cache_key(couch_server, environment.current_db, ('doc_ids', prefix))
+    return cache.get(key, lambda: fetch_doc_ids(environment, couch_server, prefix))
 
 
 def fetch_view_ids(environment, couch_server):
     if environment.current_db is None:
         return []
 
-    return filter(is_view, list(environment.current_db))
+    doc_index = _get_doc_index(environment)
+    if doc_index is not None:
+        return [view_doc_id for view_doc_id, _ in doc_index.get_views(environment.current_db)]
+
+    return [row.id for row in iter_all_docs(environment.current_db, prefix='_design/')]
 
 
 def fetch_view_paths(environment, couch_server):
-    view_ids = fetch_view_ids(environment, couch_server)
-    if not view_ids:
+    if environment.current_db is None:
         return []
 
-    paths = []
-    for view_id in view_ids:
-        view_doc = environment.current_db[view_id]
-        paths.extend([
-            '{}:{}'.format(view_id, view_name)
-            for view_name in dict(view_doc.items())['views'].keys()
-        ])
+    doc_index = _get_doc_index(environment)
+    if doc_index is not None:
+        return [
+            '{}:{}'.format(view_doc_id, view_name)
+            for view_doc_id, view_names in doc_index.get_views(environment.current_db)
+            for view_name in view_names
+        ]
+
+    return [
+        '{}:{}'.format(view_doc.id, view_name)
+        for view_doc in get_design_docs(environment.current_db)
+        for view_name in view_doc.get('views', {}).keys()
+    ]
+
 
-    return paths
+FIELD_NAME_SAMPLE_SIZE = 20
+
+
+def _iter_field_names(doc, prefix=''):
+    for name, value in doc.items():
+        yield prefix + name
+        if isinstance(value, dict):
+            yield from _iter_field_names(value, '{}{}.'.format(prefix, name))
+
+
+def fetch_field_names(environment, couch_server):
+    """Fetch the field names, nested ones as dotted paths, of the first ``FIELD_NAME_SAMPLE_SIZE`` documents."""
+    if environment.current_db is None:
+        return []
+
+    rows = iter_all_docs(environment.current_db, limit=FIELD_NAME_SAMPLE_SIZE, include_docs=True)
+    return set(field_name for row in rows if not is_view(row.id) for field_name in _iter_field_names(row['doc']))
+
+
+# The word lists the local index has, which it keeps fresher than the completion cache.
+INDEXED_KINDS = ('view_ids', 'view_paths')
+
+
+def fetch_cached(kind, fetch, environment, couch_server):
+    """Fetch the word list of ``kind`` through the environment's completion cache."""
+    database = None if kind == 'db_names' else environment.current_db
+    if kind != 'db_names' and database is None:
+        return []
+    if kind in INDEXED_KINDS and environment.doc_index is not None:
+        return list(fetch(environment, couch_server))
+
+    key = cache_key(couch_server, database, kind)
+    return environment.completion_cache.get(key, lambda: list(fetch(environment, couch_server)))
 
 
 def get_completer(environment, couch_server):
-    return GrammarCompleter(grammar, {
+    def cached_words(kind, fetch):
+        return WordCompleter(functools.partial(fetch_cached, kind, fetch, environment, couch_server))
+
+    doc_id_completer = DocIdCompleter(functools.partial(fetch_cached_doc_ids, environment, couch_server))
+    database_name_completer = cached_words('db_names', fetch_db_names)
+    db_or_doc_id_completer = CurrentDbCompleter(environment, database_name_completer, doc_id_completer)
+    fetch_cached_field_names = functools.partial(fetch_cached, 'field_names', fetch_field_names, environment,
+                                                 couch_server)
+    field_name_completer = FieldNameCompleter(fetch_cached_field_names)
+    return GrammarCompleter(grammar.compiled(), {
         'command': WordCompleter(COMMANDS.keys()),
         'target': WordCompleter(COMMANDS.keys()),
-        'database_name': WordCompleter(functools.partial(fetch_db_names, environment, couch_server)),
-        'doc_id': WordCompleter(functools.partial(fetch_doc_ids, environment, couch_server)),
-        'view_doc_id': WordCompleter(functools.partial(fetch_view_ids, environment, couch_server)),
-        'view_path': WordCompleter(functools.partial(fetch_view_paths, environment, couch_server)),
+        'database_name': database_name_completer,
+        'doc_id': doc_id_completer,
+        'literal_doc_id': doc_id_completer,
+        'doc_id_prefix': doc_id_completer,
+        'view_doc_id': cached_words('view_ids', fetch_view_ids),
+        'view_path': cached_words('view_paths', fetch_view_paths),
+        'source': db_or_doc_id_completer,
+        'destination': db_or_doc_id_completer,
+        'selector': FieldNameCompleter(fetch_cached_field_names, in_selector=True),
+        'fields': field_name_completer,
+        'sort': field_name_completer,
     })
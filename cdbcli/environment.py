@@ -1,35 +1,187 @@
 import couchdb.http
 import contextlib
 import io
+import queue
 import subprocess
 import sys
+import threading
+import time
+
+from . import filters, highlighters
+from .cache import CompletionCache
+
+
+# Output is written out once this many characters are buffered, or when
+# this many seconds have passed since it was last written out, even while
+# the command is blocked, e.g., waiting for the next page of rows.
+OUTPUT_BUFFER_SIZE = 64 * 1024
+OUTPUT_FLUSH_INTERVAL = 0.1
+
+# The number of output batches that can be waiting to be written to a pipe
+# before the command producing them is blocked.
+PIPE_QUEUE_SIZE = 16
+
+
+class PipeClosed(Exception):
+    """Raised on output once the command at the other end of the pipe stopped reading, e.g., ``head``."""
+
+
+class PipeWriter():
+    """Write to a subprocess' stdin from a separate thread.
+
+    Fetching from couchdb and writing to the pipe overlap this way. The queue
+    in between is bounded, so a slow reader slows down the writes, and once
+    the reader closes the pipe, writing raises :class:`PipeClosed`.
+    """
+    def __init__(self, stream, queue_size=PIPE_QUEUE_SIZE):
+        self._stream = stream
+        self._queue = queue.Queue(queue_size)
+        self.closed = False
+        self._thread = threading.Thread(target=self._drain)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            output = self._queue.get()
+            if output is None:
+                return
+            if self.closed:
+                continue  # keep draining, so that the writer never blocks on a full queue
+
+            try:
+                self._stream.write(bytes(output, encoding='utf-8'))
+                self._stream.flush()
+            except (IOError, OSError, ValueError):
+                self.closed = True
+
+    def write(self, output):
+        if self.closed:
+            raise PipeClosed()
+        self._queue.put(output)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Wait for the queued output to be written."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
 
 
 class Environment():
-    def __init__(self, current_db=None, output_stream=sys.stdout):
+    def __init__(self, current_db=None, output_stream=sys.stdout,
+                 highlight_chunk_size=highlighters.DEFAULT_CHUNK_SIZE,
+                 highlight_max_size=highlighters.DEFAULT_MAX_SIZE, highlight=True):
         self.current_db = current_db
         self.output_stream = output_stream
+        self.highlight_chunk_size = highlight_chunk_size
+        self.highlight_max_size = highlight_max_size
+        self.highlight = highlight
         self.cli = None
         self.previous_db = None
         self.has_pipe = False
+        self.completion_cache = CompletionCache()
+        self.doc_index = None
+        self.aio = None
+        self._output_buffer = []
+        self._output_buffer_size = 0
+        self._last_flushed_at = time.monotonic()
+        self._output_lock = threading.RLock()
+        self._flusher = None
+        self._pipe_writer = None
+        self._pipeline = None
+
+    @property
+    def output_limit(self):
+        """The most outputs the built-in filters of the current pipe take, ``None`` if there's no limit.
 
-    def output(self, text, highlighter=None):
+        Commands can use this to avoid fetching what won't be shown, e.g., for ``ls | head 10``.
+        """
+        return self._pipeline.limit if self._pipeline is not None else None
+
+    def output(self, text, highlighter=None, value=None):
         """Send text to the environment's output stream.
         :param text: the text to output
         :param highlighter: an optional function to colourize the text
+        :param value: the value the text was rendered from, e.g., a document, for the built-in filters
+
+        Large text is highlighted a chunk at a time, and text above ``highlight_max_size`` isn't highlighted.
+        The output is buffered, see :meth:`flush`.
         """
-        if not self.has_pipe:  # only colourize when the output is not piped
-            highlighter = highlighter or (lambda x: x)
-            text = highlighter(text)
-        output = "{}\n".format(text)
-        if isinstance(self.output_stream, io.BufferedIOBase):
-            output = bytes(output, encoding='utf-8')
+        if self._pipeline is None:
+            self._output(text, highlighter)
+            return
+
+        self._pipeline.feed(filters.Record(text, value, highlighter))
+        if self._pipeline.done:
+            raise PipeClosed()
+
+    def _output_record(self, record):
+        self._output(record.text, record.highlighter)
+
+    def _output(self, text, highlighter):
+        if self.has_pipe or not self.highlight or highlighter is None:  # only colourize when the output is not piped
+            self._write("{}\n".format(text))
+        else:
+            for chunk in highlighters.iter_highlighted(text, highlighter,
+                                                       self.highlight_chunk_size, self.highlight_max_size):
+                self._write(chunk)
+            self._write("\n")
+
+    def _write(self, output):
+        if self._pipe_writer is not None and self._pipe_writer.closed:
+            raise PipeClosed()
+
+        with self._output_lock:
+            self._output_buffer.append(output)
+            self._output_buffer_size += len(output)
+            if self._output_buffer_size >= OUTPUT_BUFFER_SIZE or \
+                    time.monotonic() - self._last_flushed_at >= OUTPUT_FLUSH_INTERVAL:
+                self.flush()
+            elif self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_when_idle)
+                self._flusher.daemon = True
+                self._flusher.start()
 
-        self.output_stream.write(output)
-        self.output_stream.flush()
+    def _flush_when_idle(self):
+        """Flush the buffered output once it has waited ``OUTPUT_FLUSH_INTERVAL``, while no more output comes."""
+        while True:
+            time.sleep(OUTPUT_FLUSH_INTERVAL)
+            with self._output_lock:
+                if not self._output_buffer:
+                    self._flusher = None
+                    return
+                if time.monotonic() - self._last_flushed_at >= OUTPUT_FLUSH_INTERVAL:
+                    try:
+                        self.flush()
+                    except (IOError, OSError, PipeClosed):
+                        pass  # the command sees the closed pipe on its next output
+
+    def flush(self):
+        """Write the buffered output to the output stream.
+
+        This happens on its own when enough output is buffered or enough time
+        has passed, and at the end of every command.
+        """
+        with self._output_lock:
+            self._last_flushed_at = time.monotonic()
+            if not self._output_buffer:
+                return
+
+            output = ''.join(self._output_buffer)
+            self._output_buffer, self._output_buffer_size = [], 0
+            if isinstance(self.output_stream, io.BufferedIOBase):
+                output = bytes(output, encoding='utf-8')
+
+            self.output_stream.write(output)
+            self.output_stream.flush()
 
     def run_in_terminal(self, func, render_cli_done=False):
-        assert self.cli, 'No CLI has been set'
+        self.flush()
+        if self.cli is None:
+            return func()  # e.g., in batch mode, the terminal is ours already
         return self.cli.run_in_terminal(func, render_cli_done)
 
     @classmethod
@@ -57,13 +209,31 @@ class Environment():
         prev_output_stream = self.output_stream
 
         try:
+            # the subprocesses write to the output stream directly, so it must be up-to-date
+            self.flush()
+            builtin_filters, shell_commands = filters.parse_filters(shell_commands)
+            if builtin_filters:
+                self._pipeline = filters.Pipeline(builtin_filters, self._output_record)
             subprocs = self._create_piped_subprocs(shell_commands, prev_output_stream)
             if subprocs:
                 self.has_pipe = True
-                self.output_stream = subprocs[0].stdin
+                self._pipe_writer = self.output_stream = PipeWriter(subprocs[0].stdin)
+
+            try:
+                yield self
+            except PipeClosed:
+                pass  # the filters or shell commands are done reading, there's no need to produce more output
+
+            try:
+                if self._pipeline is not None:
+                    self._pipeline, pipeline = None, self._pipeline
+                    pipeline.finish()
+                self.flush()
+            except PipeClosed:
+                pass
 
-            yield self
             if subprocs:
+                self._pipe_writer.close()
                 subprocs[0].communicate()
         except (IOError, OSError) as e:
             raise RuntimeError(str(e))
@@ -73,5 +243,14 @@ class Environment():
                 raise RuntimeError('Permission denied')
             raise RuntimeError(message)
         finally:
-            self.output_stream = prev_output_stream
-            self.has_pipe = False
+            with self._output_lock:
+                try:
+                    self.flush()
+                except (IOError, OSError, PipeClosed):
+                    self._output_buffer, self._output_buffer_size = [], 0
+                if self._pipe_writer is not None:
+                    self._pipe_writer.close()
+                self._pipe_writer = None
+                self._pipeline = None
+                self.output_stream = prev_output_stream
+                self.has_pipe = False
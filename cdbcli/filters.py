@@ -0,0 +1,272 @@
+"""Pipeline stages that run in-process instead of in a shell.
+
+The leading stages of a pipe, e.g., ``ls | head 10 | wc -l``, that are
+understood here are applied to the output of the command before anything
+is handed to the shell. They see the values behind the output, e.g., the
+documents before they are dumped as JSON, and a ``head`` tells the command
+how much output it needs, so it doesn't fetch more than that.
+
+Stages with arguments that aren't understood here, and everything after
+them, still run in the shell.
+"""
+import json
+import re
+from collections import namedtuple
+
+from cdbcli import highlighters
+
+
+Record = namedtuple('Record', ['text', 'value', 'highlighter'])
+
+
+class Filter():
+    """A pipeline stage.
+
+    ``keeps_rows`` tells whether every record fed in results in exactly one record out.
+    """
+    keeps_rows = False
+
+    def __init__(self):
+        self.done = False
+        self.limit = None
+
+    def feed(self, record):
+        """Return the records to pass on for ``record``."""
+        return [record]
+
+    def finish(self):
+        """Return the records to pass on once the input ended."""
+        return []
+
+
+def _split_lines(record):
+    lines = record.text.split('\n')
+    if len(lines) == 1:
+        return [record]
+    # a line of a document isn't valid JSON on its own, so it isn't highlighted
+    return [Record(line, None, None) for line in lines]
+
+
+class Head(Filter):
+    """head [-n] <n>: only pass on the first <n> lines."""
+    def __init__(self, lines):
+        super().__init__()
+        self.limit = self._remaining = lines
+        self.done = lines == 0
+
+    def feed(self, record):
+        records = []
+        for line_record in _split_lines(record):
+            if self._remaining == 0:
+                break
+            records.append(line_record)
+            self._remaining -= 1
+
+        if len(records) == len(record.text.split('\n')):
+            records = [record]  # keep the value behind the output, it wasn't cut
+        self.done = self._remaining == 0
+        return records
+
+
+class Grep(Filter):
+    """grep [-i] [-v] [-E|-F] <text>: only pass on the lines containing <text>.
+
+    Only fixed strings are matched here, patterns with regular expression
+    syntax are left to the shell's grep.
+    """
+    def __init__(self, text, ignore_case=False, invert=False):
+        super().__init__()
+        self._ignore_case = ignore_case
+        self._text = text.lower() if ignore_case else text
+        self._invert = invert
+
+    def _matches(self, line):
+        return self._text in (line.lower() if self._ignore_case else line)
+
+    def feed(self, record):
+        return [line_record for line_record in _split_lines(record)
+                if self._matches(line_record.text) != self._invert]
+
+
+class Wc(Filter):
+    """wc -l: count the lines."""
+    def __init__(self):
+        super().__init__()
+        self._lines = 0
+
+    def feed(self, record):
+        self._lines += record.text.count('\n') + 1
+        return []
+
+    def finish(self):
+        return [Record(str(self._lines), self._lines, None)]
+
+
+_PATH_RE = re.compile(r'\.([A-Za-z_][A-Za-z0-9_]*)|\["((?:[^"\\]|\\.)*)"\]|\[(-?[0-9]+)\]')
+
+
+def parse_path(path):
+    """Parse a ``jq`` style path, e.g., ``.value.names[0]``, into a list of keys and indices.
+
+    Return ``None`` if ``path`` isn't a path.
+    """
+    if path == '.':
+        return []
+    if not path.startswith('.'):
+        return None
+    if path.startswith('.['):
+        path = path[1:]
+
+    steps = []
+    position = 0
+    while position < len(path):
+        m = _PATH_RE.match(path, position)
+        if not m:
+            return None
+        name, quoted_name, index = m.groups()
+        if name is not None:
+            steps.append(name)
+        elif quoted_name is not None:
+            steps.append(json.loads('"{}"'.format(quoted_name)))
+        else:
+            steps.append(int(index))
+        position = m.end()
+    return steps
+
+
+def get_path(value, steps):
+    """Follow ``steps`` into ``value``; missing keys and indices yield ``None``, like ``jq`` does."""
+    for step in steps:
+        if value is None:
+            return None
+        if isinstance(step, int):
+            if not isinstance(value, list):
+                raise RuntimeError('jq: Cannot index {} with number'.format(type(value).__name__))
+            value = value[step] if -len(value) <= step < len(value) else None
+        else:
+            if not isinstance(value, dict):
+                raise RuntimeError('jq: Cannot index {} with "{}"'.format(type(value).__name__, step))
+            value = value.get(step)
+    return value
+
+
+class Jq(Filter):
+    """jq <path>: pass on the value at <path>, e.g., ``.value.names[0]``, of every JSON record."""
+    keeps_rows = True
+
+    def __init__(self, steps):
+        super().__init__()
+        self._steps = steps
+
+    def feed(self, record):
+        value = record.value
+        if value is None:
+            try:
+                value = json.loads(record.text)
+            except ValueError:
+                raise RuntimeError('jq: Not JSON: {}'.format(record.text))
+
+        value = get_path(value, self._steps)
+        return [Record(json.dumps(value, sort_keys=True, indent=4), value, highlighters.json)]
+
+
+def _parse_head(args):
+    if not args:
+        return Head(10)
+    if len(args) == 2 and args[0] == '-n':
+        args = args[1:]
+    if len(args) != 1:
+        return None
+
+    m = re.match(r'^(?:-n|-)?([0-9]+)$', args[0])
+    return Head(int(m.group(1))) if m else None
+
+
+# The characters with a special meaning in basic and extended regular expressions, everything else matches itself.
+_BRE_SPECIAL_CHARS = set('\\.[*^$')
+_ERE_SPECIAL_CHARS = _BRE_SPECIAL_CHARS | set('+?{}|()')
+
+
+def _parse_grep(args):
+    options = set()
+    while len(args) > 1 and re.match(r'^-[ivEF]+$', args[0]):
+        options.update(args[0][1:])
+        args = args[1:]
+    if len(args) != 1 or {'E', 'F'} <= options:
+        return None
+
+    special_chars = set() if 'F' in options else _ERE_SPECIAL_CHARS if 'E' in options else _BRE_SPECIAL_CHARS
+    if special_chars & set(args[0]):
+        return None
+    return Grep(args[0], ignore_case='i' in options, invert='v' in options)
+
+
+def _parse_wc(args):
+    return Wc() if args == ['-l'] else None
+
+
+def _parse_jq(args):
+    if len(args) != 1:
+        return None
+
+    steps = parse_path(args[0])
+    return Jq(steps) if steps is not None else None
+
+
+FILTERS = {
+    'head': _parse_head,
+    'grep': _parse_grep,
+    'wc': _parse_wc,
+    'jq': _parse_jq,
+}
+
+
+def parse_filters(shell_commands):
+    """Split the shell commands into the leading built-in filters and the shell commands after them.
+
+    :param shell_commands: the commands after the pipes, e.g., ``[['head', '10'], ['sort']]``
+    :return: a tuple ``(filters, shell_commands)``
+    """
+    filters = []
+    for i, shell_command in enumerate(shell_commands):
+        parse = FILTERS.get(shell_command[0]) if shell_command else None
+        filter_ = parse(shell_command[1:]) if parse else None
+        if filter_ is None:
+            return filters, shell_commands[i:]
+        filters.append(filter_)
+    return filters, []
+
+
+class Pipeline():
+    """Run records through a chain of filters, then hand the result to ``write``."""
+    def __init__(self, filters, write):
+        self._filters = filters
+        self._write = write
+
+    @property
+    def done(self):
+        """Whether the pipeline takes no more input."""
+        return any(filter_.done for filter_ in self._filters)
+
+    @property
+    def limit(self):
+        """The most records the pipeline will ever take, or ``None`` when there's no such limit."""
+        for filter_ in self._filters:
+            if filter_.limit is not None:
+                return filter_.limit
+            if not filter_.keeps_rows:
+                return None
+        return None
+
+    def _run(self, records, start=0):
+        for filter_ in self._filters[start:]:
+            records = [output for record in records for output in filter_.feed(record)]
+        for record in records:
+            self._write(record)
+
+    def feed(self, record):
+        self._run([record])
+
+    def finish(self):
+        for i, filter_ in enumerate(self._filters):
+            self._run(filter_.finish(), i + 1)
@@ -22,4 +22,24 @@ def _create_grammar():
     return compiler.compile(patterns)
 
 
-grammar = _create_grammar()
+class _LazyGrammar():
+    """The grammar of all the commands, compiled on first use.
+
+    Compiling the grammar is the most expensive part of starting cdbcli, so
+    it's deferred until a command is actually parsed, highlighted or completed.
+    Attributes, e.g., ``match_prefix``, are looked up on the compiled grammar.
+    """
+    def __init__(self):
+        self._grammar = None
+
+    def compiled(self):
+        """Return the compiled grammar, e.g., for prompt_toolkit's grammar lexer and completer, which require one."""
+        if self._grammar is None:
+            self._grammar = _create_grammar()
+        return self._grammar
+
+    def __getattr__(self, name):
+        return getattr(self.compiled(), name)
+
+
+grammar = _LazyGrammar()
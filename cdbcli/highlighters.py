@@ -1,18 +1,75 @@
-import pygments
-from pygments import lexers, formatters
+import functools
+import io
 
 
-def json(formatted_json):
-    return pygments.highlight(formatted_json, lexers.JsonLexer(), formatters.TerminalFormatter())
+# Text larger than this is highlighted a chunk at a time, and text larger
+# than ``DEFAULT_MAX_SIZE`` isn't highlighted at all.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE = 4 * 1024 * 1024
 
 
-def javascript(code):
-    return pygments.highlight(code, lexers.JavascriptLexer(), formatters.TerminalFormatter())
+@functools.lru_cache(maxsize=None)
+def _get_lexer(lexer_name):
+    # pygments is imported on first use, so that it doesn't slow down cdbcli's start-up
+    from pygments import lexers
+    # without ensurenl, the highlighted text doesn't get a new line the text didn't have
+    return getattr(lexers, lexer_name)(ensurenl=False)
 
 
-def python(code):
-    return pygments.highlight(code, lexers.PythonLexer(), formatters.TerminalFormatter())
+@functools.lru_cache(maxsize=None)
+def _get_formatter():
+    from pygments import formatters
+    return formatters.TerminalFormatter()
 
 
-def erlang(code):
-    return pygments.highlight(code, lexers.ErlangLexer(), formatters.TerminalFormatter())
+def _format(tokens):
+    output = io.StringIO()
+    _get_formatter().format(tokens, output)
+    return output.getvalue()
+
+
+def _pygments_highlighter(lexer_name):
+    def highlight(code):
+        return _format(_get_lexer(lexer_name).get_tokens(code))
+    highlight.lexer_name = lexer_name
+    return highlight
+
+
+json = _pygments_highlighter('JsonLexer')
+javascript = _pygments_highlighter('JavascriptLexer')
+python = _pygments_highlighter('PythonLexer')
+erlang = _pygments_highlighter('ErlangLexer')
+
+
+def _iter_highlighted_chunks(text, lexer_name, chunk_size):
+    tokens, size = [], 0
+    for token in _get_lexer(lexer_name).get_tokens(text):
+        tokens.append(token)
+        size += len(token[1])
+        if size >= chunk_size:
+            yield _format(tokens)
+            tokens, size = [], 0
+
+    if tokens:
+        yield _format(tokens)
+
+
+def iter_highlighted(text, highlighter, chunk_size=DEFAULT_CHUNK_SIZE, max_size=DEFAULT_MAX_SIZE):
+    """Highlight the text, yielding the highlighted text a chunk at a time.
+
+    The text is lexed in one pass, so highlighting it in chunks gives the
+    same result as highlighting it at once.
+
+    :param text: the text to highlight
+    :param highlighter: the function to colourize the text with
+    :param chunk_size: text larger than this is highlighted in chunks of about this size
+    :param max_size: text larger than this is yielded as is
+    """
+    lexer_name = getattr(highlighter, 'lexer_name', None)
+    if len(text) > max_size:
+        yield text
+    elif len(text) > chunk_size and lexer_name:
+        for chunk in _iter_highlighted_chunks(text, lexer_name, chunk_size):
+            yield chunk
+    else:
+        yield highlighter(text)
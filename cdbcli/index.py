@@ -0,0 +1,157 @@
+"""An on-disk index of the documents of the databases visited, kept in SQLite.
+
+The index holds the id and revision of every document, and the view names of
+every design document. A database is indexed from ``_changes`` the first time
+it's visited, after that only the changes since the last one seen are read,
+so listing and completing the ids of a large database doesn't fetch the whole
+id list again.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+import couchdb
+
+
+# The index is refreshed at most once in this many seconds for completion.
+REFRESH_INTERVAL = 5
+INDEX_CHANGES_PAGE_SIZE = 10000
+INDEX_PAGE_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS databases (
+    url TEXT PRIMARY KEY,
+    last_seq TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS docs (
+    url TEXT NOT NULL,
+    id TEXT NOT NULL,
+    rev TEXT NOT NULL,
+    views TEXT,
+    PRIMARY KEY (url, id)
+) WITHOUT ROWID;
+"""
+
+
+def _is_design_doc(doc_id):
+    return doc_id.startswith('_design/')
+
+
+class DocIndex():
+    """The index of the documents of every database visited, stored in the SQLite database at ``path``.
+
+    Databases are told apart by their URL, so one index file serves several servers.
+    """
+    def __init__(self, path, changes_page_size=INDEX_CHANGES_PAGE_SIZE, clock=time.monotonic):
+        self.path = path
+        self.changes_page_size = changes_page_size
+        self._clock = clock
+        self._refreshed_at = {}
+        self._lock = threading.RLock()
+        # completions are fetched from a thread of their own
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def _get_last_seq(self, url):
+        row = self._connection.execute('SELECT last_seq FROM databases WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]) if row else 0
+
+    def refresh(self, database, max_age=0):
+        """Apply the changes of ``database`` since the last one seen, indexing the database if it's new.
+
+        :param max_age: don't refresh if the last refresh was less than this many seconds ago
+        """
+        url = database.resource.url
+        with self._lock:
+            refreshed_at = self._refreshed_at.get(url)
+            if refreshed_at is not None and self._clock() - refreshed_at < max_age:
+                return
+
+            since = self._get_last_seq(url)
+            try:
+                self._read_changes(database, url, since)
+            except couchdb.ServerError as e:
+                status, _ = e.args[0]
+                if since == 0 or status != 400:
+                    raise
+                # the database was recreated and its sequence numbers started over, so index it again
+                self.forget(database)
+                self._read_changes(database, url, 0)
+            self._refreshed_at[url] = self._clock()
+
+    def _read_changes(self, database, url, since):
+        while True:
+            result = database.changes(since=since, limit=self.changes_page_size, style='main_only')
+            changes = result['results']
+            views = self._fetch_views(database, [change['id'] for change in changes
+                                                 if _is_design_doc(change['id']) and not change.get('deleted')])
+
+            # a page at a time, so an interrupted indexing resumes from the last page read
+            with self._connection:
+                for change in changes:
+                    if change.get('deleted'):
+                        self._connection.execute('DELETE FROM docs WHERE url = ? AND id = ?', (url, change['id']))
+                    else:
+                        self._connection.execute('INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?)',
+                                                 (url, change['id'], change['changes'][0]['rev'],
+                                                  views.get(change['id'])))
+                self._connection.execute('INSERT OR REPLACE INTO databases VALUES (?, ?)',
+                                         (url, json.dumps(result['last_seq'])))
+
+            if len(changes) < self.changes_page_size:
+                return
+            since = result['last_seq']
+
+    def _fetch_views(self, database, design_doc_ids):
+        if not design_doc_ids:
+            return {}
+
+        rows = database.view('_all_docs', keys=design_doc_ids, include_docs=True)
+        return {row.id: json.dumps(sorted(row.doc.get('views', {}))) for row in rows if row.get('doc')}
+
+    def forget(self, database):
+        """Drop everything indexed about ``database``."""
+        url = database.resource.url
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM docs WHERE url = ?', (url,))
+            self._connection.execute('DELETE FROM databases WHERE url = ?', (url,))
+            self._refreshed_at.pop(url, None)
+
+    def iter_docs(self, database, startkey=None, endkey=None, limit=None, page_size=None):
+        """Yield ``(doc_id, rev)`` for the indexed documents of ``database`` in id order, like ``_all_docs``.
+
+        :param startkey: the first document id to yield
+        :param endkey: the last document id to yield
+        :param limit: the maximum number of documents to yield
+        :param page_size: the number of documents to read at a time
+        """
+        page_size = page_size or INDEX_PAGE_SIZE
+        url = database.resource.url
+        query, args = 'SELECT id, rev FROM docs WHERE url = ? AND id >= ?', [url, startkey or '']
+        if endkey is not None:
+            query, args = query + ' AND id <= ?', args + [endkey]
+
+        while limit is None or limit > 0:
+            page_limit = page_size if limit is None else min(page_size, limit)
+            with self._lock:
+                rows = self._connection.execute(query + ' ORDER BY id LIMIT ?', args + [page_limit]).fetchall()
+
+            yield from rows
+            if len(rows) < page_limit:
+                return
+
+            if limit is not None:
+                limit -= page_limit
+            query, args = query.replace('id >= ?', 'id > ?'), [url, rows[-1][0]] + args[2:]
+
+    def get_views(self, database):
+        """Return ``(design_doc_id, view_names)`` for the indexed design documents of ``database``."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, views FROM docs WHERE url = ? AND id >= '_design/' AND id < '_design0' ORDER BY id",
+                (database.resource.url,)).fetchall()
+        return [(doc_id, json.loads(views) if views else []) for doc_id, views in rows]
@@ -1,17 +1,28 @@
 import shlex
 
 from prompt_toolkit.contrib.regular_languages.lexer import GrammarLexer
-from prompt_toolkit.layout.lexers import SimpleLexer
+from prompt_toolkit.layout.lexers import Lexer, SimpleLexer
 from prompt_toolkit.token import Token
 
 from .grammar import grammar
 
 
-lexer = GrammarLexer(grammar, lexers={
-    'command': SimpleLexer(Token.Command),
-    'operand': SimpleLexer(Token.Operand),
-    'database_name': SimpleLexer(Token.Operand),
-})
+class CommandLexer(Lexer):
+    """Highlight the command line with a grammar lexer, created once the grammar is first needed."""
+    def __init__(self):
+        self._lexer = None
+
+    def lex_document(self, cli, document):
+        if self._lexer is None:
+            self._lexer = GrammarLexer(grammar.compiled(), lexers={
+                'command': SimpleLexer(Token.Command),
+                'operand': SimpleLexer(Token.Operand),
+                'database_name': SimpleLexer(Token.Operand),
+            })
+        return self._lexer.lex_document(cli, document)
+
+
+lexer = CommandLexer()
 
 
 def split_cli_command_and_shell_commands(command_text):
@@ -43,3 +54,46 @@ def split_cli_command_and_shell_commands(command_text):
         return ' '.join(parts[0]), []
 
     return ' '.join(parts[0]), parts[1:]
+
+
+def split_commands(text):
+    """Split a script into its commands, which are separated by ``;`` or new lines
+
+    Separators in quotes don't count, and lines starting with ``#`` are comments, e.g.::
+
+        # list the docs of db
+        cd db; ls | grep "a;b"
+
+    is the commands ``cd db`` and ``ls | grep "a;b"``.
+    """
+    commands = []
+    current = []
+    quote = None
+    escaped = False
+    in_comment = False
+    for char in text:
+        if in_comment:
+            in_comment = char != '\n'
+        elif escaped:
+            current.append(char)
+            escaped = False
+        elif char == '\\' and quote != "'":
+            current.append(char)
+            escaped = True
+        elif quote is not None:
+            current.append(char)
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            current.append(char)
+            quote = char
+        elif char in ';\n':
+            commands.append(''.join(current).strip())
+            current = []
+        elif char == '#' and not ''.join(current).strip():
+            in_comment = True
+        else:
+            current.append(char)
+
+    commands.append(''.join(current).strip())
+    return [command for command in commands if command]
@@ -1,22 +1,31 @@
-import couchdb
 import click
 import sys
 import os
 
-from cdbcli import repl
+from cdbcli import highlighters
 from cdbcli import __version__ as cdbcli_version
 
-from prompt_toolkit import prompt
-
 
 class Config():
-    def __init__(self, host, port, username, password, tls, database):
+    def __init__(self, host, port, username, password, tls, database,
+                 highlight_chunk_size=highlighters.DEFAULT_CHUNK_SIZE,
+                 highlight_max_size=highlighters.DEFAULT_MAX_SIZE, index=None, pool_size=10, connect_timeout=10,
+                 read_timeout=None, keepalive=True, accept_gzip=True, compress_requests=False):
         self.__host = host
         self.__port = port
         self.__username = username
         self.__password = password
         self.__scheme = 'https' if tls else 'http'
         self.database = database
+        self.highlight_chunk_size = highlight_chunk_size
+        self.highlight_max_size = highlight_max_size
+        self.index = index
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive = keepalive
+        self.accept_gzip = accept_gzip
+        self.compress_requests = compress_requests
 
         if not username and password:
             self.__username = 'admin'
@@ -53,21 +62,156 @@ class Config():
 @click.option('-p', '--password', default=None, help='The password')
 @click.option('-P', '--askpass/--no-askpass', default=False, help='Ask for password?')
 @click.option('--tls/--no-tls', default=False, help='Use TLS to connect to the couchdb instance?')
+@click.option('--highlight-chunk-size', default=highlighters.DEFAULT_CHUNK_SIZE, type=int,
+              help='Highlight output larger than this many bytes in chunks')
+@click.option('--highlight-max-size', default=highlighters.DEFAULT_MAX_SIZE, type=int,
+              help='Do not highlight output larger than this many bytes')
+@click.option('--dump', default=None, metavar='FILE',
+              help='Export all the documents of DATABASE to FILE, one JSON document per line, and exit')
+@click.option('--index', default=None, metavar='FILE',
+              help='Keep an index of the documents of the databases visited in the SQLite FILE')
+@click.option('--pool-size', default=10, type=int,
+              help='Keep up to this many idle connections to the couchdb instance')
+@click.option('--connect-timeout', default=10, type=float,
+              help='Give up connecting to the couchdb instance after this many seconds')
+@click.option('--read-timeout', default=None, type=float,
+              help='Give up waiting for a response after this many seconds (default: wait forever)')
+@click.option('--keepalive/--no-keepalive', default=True, help='Use TCP keep-alive on the connections?')
+@click.option('--gzip/--no-gzip', 'accept_gzip', default=True, help='Ask for gzip compressed responses?')
+@click.option('--compress-requests', is_flag=True, help='Gzip large request bodies, e.g., of bulk writes')
+@click.option('--show-transfer', is_flag=True, help='Show the bytes sent and received by every command')
+@click.option('-c', '--command', default=None, metavar='COMMANDS',
+              help='Run the COMMANDS, separated by ";", and exit')
+@click.option('-f', '--file', 'script', default=None, type=click.File('r'), metavar='FILE',
+              help='Run the commands in FILE, one per line, and exit ("-" reads them from stdin)')
 @click.option('-ver', '--version', is_flag=True)
 @click.argument('database', default='', required=False)
-def main(host, port, username, password, askpass, tls, version, database):
+def main(host, port, username, password, askpass, tls, highlight_chunk_size, highlight_max_size, dump, index,
+         pool_size, connect_timeout, read_timeout, keepalive, accept_gzip, compress_requests, show_transfer, command,
+         script, version, database):
     if version:
         print(get_version())
         return 0
 
+    if sum(option is not None for option in (dump, command, script)) > 1:
+        raise click.UsageError('--dump, --command and --file are mutually exclusive')
+
+    # The couchdb client and the REPL are imported here, as loading them
+    # takes up most of the start-up time and ``--version`` needs neither.
+    import sqlite3
+    from cdbcli import repl
+
     if askpass:
+        from prompt_toolkit import prompt
         password = prompt('Enter password: ', is_password=True)
 
-    config = Config(host, port, username, password, tls, database)
-    couch_server = couchdb.Server(config.url)
-    r = repl.Repl(couch_server, config)
+    config = Config(host, port, username, password, tls, database, highlight_chunk_size, highlight_max_size, index,
+                    pool_size, connect_timeout, read_timeout, keepalive, accept_gzip, compress_requests)
+    couch_server = create_couch_server(config)
+    if dump:
+        return run_dump(couch_server, config, dump)
+    if command is not None or script is not None:
+        from cdbcli.lexer import split_commands
+        command_texts = split_commands(command if command is not None else script.read())
+        sys.exit(run_batch(couch_server, config, command_texts, show_transfer))
+
+    try:
+        r = repl.Repl(couch_server, config, show_transfer=show_transfer)
+    except sqlite3.Error as e:
+        raise click.ClickException('Unable to open the index {}: {!s}'.format(index, e))
     return r.run()
 
 
+def create_couch_server(config):
+    """Return the couchdb server of ``config``, on a session with the connection settings of ``config``."""
+    import couchdb
+    from cdbcli.session import Session
+
+    session = Session(config.pool_size, config.connect_timeout, config.read_timeout, config.keepalive,
+                      config.accept_gzip, config.compress_requests)
+    return couchdb.Server(config.url, session=session)
+
+
+def run_dump(couch_server, config, file_name):
+    import couchdb
+    from cdbcli import commands
+
+    if not config.database:
+        raise click.UsageError('--dump requires a DATABASE')
+
+    try:
+        database = couch_server[config.database]
+        count = commands.dump_database(database, file_name)
+    except couchdb.ResourceNotFound:
+        raise click.ClickException("Database '{}' does not exist".format(config.database))
+    except (IOError, OSError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+
+    print('Dumped {} documents to {}'.format(count, file_name))
+    return 0
+
+
+def run_batch(couch_server, config, command_texts, show_transfer=False):
+    """Run ``command_texts`` one after the other, without the interactive prompt, and return the exit code.
+
+    The output goes to stdout, highlighted only when it's a terminal, and the
+    errors to stderr. The first command that fails stops the run.
+    """
+    import asyncio
+    import couchdb
+    import http.client
+    import socket
+    import sqlite3
+    from cdbcli import repl
+    from cdbcli.commands import _convert_bytes_to_human_readable
+    from cdbcli.environment import Environment
+    from cdbcli.index import DocIndex
+
+    environment = Environment(output_stream=sys.stdout, highlight_chunk_size=config.highlight_chunk_size,
+                              highlight_max_size=config.highlight_max_size, highlight=sys.stdout.isatty())
+    counter = couch_server.resource.session.counter
+    try:
+        if config.index:
+            try:
+                environment.doc_index = DocIndex(config.index)
+            except sqlite3.Error as e:
+                raise click.ClickException('Unable to open the index {}: {!s}'.format(config.index, e))
+        if config.database:
+            try:
+                environment.current_db = couch_server[config.database]
+            except couchdb.ResourceNotFound:
+                click.echo("Database '{}' not found".format(config.database), err=True)
+                return 1
+
+        for command_text in command_texts:
+            counter.reset()
+            try:
+                repl.eval_(environment, couch_server, command_text)
+            except (socket.error, http.client.HTTPException, asyncio.TimeoutError) as e:
+                click.echo('Error: {}'.format(str(e) or e.__class__.__name__), err=True)
+                return 1
+            finally:
+                environment.flush()
+            if show_transfer:
+                transfer = counter.reset()
+                click.echo('Sent {}, received {} ({} decoded) in {} requests'.format(
+                    _convert_bytes_to_human_readable(transfer.sent),
+                    _convert_bytes_to_human_readable(transfer.received),
+                    _convert_bytes_to_human_readable(transfer.decoded), transfer.requests), err=True)
+    except EOFError:
+        return 0  # exit
+    except KeyboardInterrupt:
+        return 130
+    except (RuntimeError, ValueError, IOError, OSError, couchdb.HTTPError) as e:
+        click.echo('Error: {!s}'.format(e), err=True)
+        return 1
+    finally:
+        if environment.aio is not None:
+            environment.aio.close()
+        if environment.doc_index is not None:
+            environment.doc_index.close()
+    return 0
+
+
 def get_version():
     return '{} version {}'.format(os.path.basename(sys.argv[0]), cdbcli_version)
@@ -1,14 +1,21 @@
+import time
+from collections import namedtuple
+
 import couchdb
 import prompt_toolkit as pt
 
 from cdbcli import __version__ as cdbcli_version
 from prompt_toolkit import history, shortcuts
+from prompt_toolkit.token import Token
 from .lexer import lexer, split_cli_command_and_shell_commands
 from .completer import get_completer
 from .style import style
 from .grammar import grammar
-from .commands import COMMANDS
+from .commands import COMMANDS, _convert_bytes_to_human_readable
 from .environment import Environment
+from .aio import Runner
+from .index import DocIndex
+from .session import Session
 
 
 BANNER = """
@@ -26,6 +33,9 @@ BANNER = """
 """
 
 
+CommandTiming = namedtuple('CommandTiming', ['command', 'elapsed', 'overhead'])
+
+
 def eval_(environment, couch_server, command_text):
     if not command_text:
         return
@@ -42,15 +52,29 @@ def eval_(environment, couch_server, command_text):
         raise RuntimeError('{}: command not found'.format(cli_command))
 
     handler, _, _ = COMMANDS[command]
+    if environment.aio is None:
+        environment.aio = Runner()
     with environment.pipe(shell_commands) as environment:
         handler(environment=environment, couch_server=couch_server, variables=m.variables())
 
 
 class Repl():
-    def __init__(self, couch_server, config, environment=None):
+    def __init__(self, couch_server, config, environment=None, show_transfer=False):
         self._couch_server = couch_server
         self._config = config
-        self._environment = environment or Environment()
+        if environment is None:
+            environment = Environment(highlight_chunk_size=config.highlight_chunk_size,
+                                      highlight_max_size=config.highlight_max_size)
+            if config.index:
+                environment.doc_index = DocIndex(config.index)
+        self._environment = environment
+        self._prompt_tokens = None
+        self._pending_timing = None
+        self.last_command_timing = None
+        self._show_transfer = show_transfer
+        session = couch_server.resource.session
+        self._transfer_counter = session.counter if isinstance(session, Session) else None
+        self.last_command_transfer = None
 
         try:
             if self._config.database:
@@ -76,23 +100,59 @@ class Repl():
                                 couchdb_version=self._couch_server.version())
         self._environment.output(message)
 
+    def _get_prompt_tokens(self, cli):
+        return self._prompt_tokens
+
+    def _refresh_prompt(self):
+        self._prompt_tokens = [(Token.Prompt, self.prompt)]
+
+    def _create_cli(self):
+        application = shortcuts.create_prompt_application(
+            get_prompt_tokens=self._get_prompt_tokens,
+            history=history.InMemoryHistory(),
+            enable_history_search=True,
+            enable_open_in_editor=True,
+            lexer=lexer,
+            completer=get_completer(self._environment, self._couch_server),
+            style=style,
+        )
+        return pt.CommandLineInterface(application=application, eventloop=shortcuts.create_eventloop())
+
+    def _output_transfer(self, transfer):
+        self._environment.output('Sent {}, received {} ({} decoded) in {} requests'.format(
+            _convert_bytes_to_human_readable(transfer.sent), _convert_bytes_to_human_readable(transfer.received),
+            _convert_bytes_to_human_readable(transfer.decoded), transfer.requests))
+
+    def _reset_transfer(self):
+        return self._transfer_counter.reset() if self._transfer_counter is not None else None
+
+    def _on_prompt_ready(self):
+        """Record how long the last command took, and the time it took to get back to the prompt."""
+        if self._pending_timing is not None and self._show_transfer and self.last_command_transfer is not None:
+            self._output_transfer(self.last_command_transfer)
+        self._environment.flush()
+        if self._pending_timing is None:
+            return
+
+        command, entered_at, finished_at = self._pending_timing
+        self._pending_timing = None
+        self.last_command_timing = CommandTiming(command, finished_at - entered_at, time.monotonic() - finished_at)
+
     def _run(self):
-        args = {
-            'history': history.InMemoryHistory(),
-            'enable_history_search': True,
-            'enable_open_in_editor': True,
-            'lexer': lexer,
-            'completer': get_completer(self._environment, self._couch_server),
-            'style': style,
-        }
+        self._refresh_prompt()
+        cli = self._create_cli()
+        self._environment.cli = cli
         while True:
             try:
-                cli = pt.CommandLineInterface(application=shortcuts.create_prompt_application(self.prompt, **args),
-                                              eventloop=shortcuts.create_eventloop())
-                self._environment.cli = cli
-                cmd_text = cli.run().text.rstrip()
-                eval_(self._environment, self._couch_server, cmd_text)
-                cli.reset()
+                cmd_text = cli.run(reset_current_buffer=True, pre_run=self._on_prompt_ready).text.rstrip()
+                entered_at = time.monotonic()
+                self._reset_transfer()  # leave out the requests of the completion
+                try:
+                    eval_(self._environment, self._couch_server, cmd_text)
+                finally:
+                    self._pending_timing = (cmd_text, entered_at, time.monotonic())
+                    self.last_command_transfer = self._reset_transfer()
+                    self._refresh_prompt()
             except RuntimeError as e:
                 self._environment.output(str(e))
             except (EOFError, KeyboardInterrupt):
@@ -106,3 +166,7 @@ class Repl():
             self._environment.output('Error connecting to the couchdb instance: {!s}'.format(e))
         else:
             self._run()
+        finally:
+            self._environment.flush()
+            if self._environment.aio is not None:
+                self._environment.aio.close()
@@ -0,0 +1,273 @@
+"""The HTTP sessions cdbcli talks to couchdb through.
+
+couchdb-python keeps connections alive in a pool of its own, but has a single
+timeout for everything and keeps every connection it ever opened. The
+:class:`Session` here bounds the number of idle connections kept per host,
+has separate connect and read timeouts, turns on TCP keep-alive, so idle
+connections survive firewalls and dead peers are noticed, and resumes TLS
+sessions when it reconnects to a host.
+
+It also asks for gzip compressed responses, which it decompresses as they're
+read, can gzip large request bodies, e.g., of ``_bulk_docs``, and counts the
+bytes sent and received.
+"""
+import gzip
+import http.client
+import re
+import socket
+import ssl
+import threading
+import zlib
+from collections import namedtuple
+
+import couchdb.http
+import couchdb.json
+from couchdb import util
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+# Views can take a long time to build, so reads don't time out by default.
+DEFAULT_READ_TIMEOUT = None
+
+# Probe a connection that has been idle for this many seconds, this many seconds apart, up to this many times.
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+# Request bodies smaller than this aren't worth compressing.
+COMPRESS_MIN_SIZE = 1024
+_READ_SIZE = 64 * 1024
+
+# TLS sessions can only be resumed from Python 3.6 on.
+_CAN_RESUME_TLS_SESSIONS = hasattr(ssl.SSLSocket, 'session')
+
+# Feeds that stream until the client goes away are parsed a chunk at a time, so they can't be compressed.
+_STREAMING_FEED_RE = re.compile(r'[?&]feed=(continuous|eventsource)(&|$)')
+
+
+TransferStats = namedtuple('TransferStats', ['requests', 'sent', 'received', 'decoded'])
+
+
+class TransferCounter():
+    """Count the requests, the request body bytes sent, and the response body bytes received and decoded."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = TransferStats(0, 0, 0, 0)
+
+    def add(self, requests=0, sent=0, received=0, decoded=0):
+        with self._lock:
+            self._stats = TransferStats(self._stats.requests + requests, self._stats.sent + sent,
+                                        self._stats.received + received, self._stats.decoded + decoded)
+
+    def reset(self):
+        """Start counting from zero, and return the counts so far."""
+        with self._lock:
+            stats, self._stats = self._stats, TransferStats(0, 0, 0, 0)
+        return stats
+
+
+def _set_keepalive(sock):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):  # not every platform has them
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class HTTPResponse(http.client.HTTPResponse):
+    """A response which decompresses a gzip encoded body as it's read, no more than asked for at a time."""
+    _decompressor = None
+    _counter = None
+
+    def start_decoding(self, counter):
+        self._counter = counter
+        if (self.getheader('Content-Encoding') or '').lower() in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._decoded = b''
+
+    def _read_raw(self, amt=None):
+        data = super().read(amt)
+        if self._counter is not None:
+            self._counter.add(received=len(data), decoded=0 if self._decompressor else len(data))
+        return data
+
+    def read(self, amt=None):
+        if self._decompressor is None:
+            return self._read_raw(amt)
+
+        while amt is None or len(self._decoded) < amt:
+            data = self._decompressor.unconsumed_tail or self._read_raw(_READ_SIZE if amt is None else amt)
+            if not data:
+                self._decoded += self._decompressor.flush()
+                break
+            self._decoded += self._decompressor.decompress(data, 0 if amt is None else amt - len(self._decoded))
+
+        if amt is None:
+            data, self._decoded = self._decoded, b''
+        else:
+            data, self._decoded = self._decoded[:amt], self._decoded[amt:]
+        if self._counter is not None:
+            self._counter.add(decoded=len(data))
+        return data
+
+
+class _PooledConnection():
+    response_class = HTTPResponse
+
+    def getresponse(self):
+        response = super().getresponse()
+        response.start_decoding(self._pool.counter)
+        return response
+
+
+class HTTPConnection(_PooledConnection, http.client.HTTPConnection):
+    def __init__(self, host, pool):
+        super().__init__(host, timeout=pool.connect_timeout)
+        self._pool = pool
+
+    def connect(self):
+        super().connect()
+        self._pool.prepare_socket(self.sock)
+        self.sock.settimeout(self._pool.read_timeout)
+
+
+class HTTPSConnection(_PooledConnection, http.client.HTTPSConnection):
+    """An HTTPS connection which resumes the last TLS session of its host."""
+    def __init__(self, host, pool):
+        super().__init__(host, timeout=pool.connect_timeout, context=pool.ssl_context)
+        self._pool = pool
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self._pool.prepare_socket(self.sock)
+        server_hostname = self._tunnel_host or self.host
+        options = {'session': self._pool.get_tls_session(self.host)} if _CAN_RESUME_TLS_SESSIONS else {}
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, **options)
+        self.sock.settimeout(self._pool.read_timeout)  # the handshake ran under the connect timeout
+
+
+class ConnectionPool(couchdb.http.ConnectionPool):
+    """A pool keeping up to ``pool_size`` idle connections per host, extra ones are closed when released.
+
+    :param pool_size: the number of idle connections to keep per host
+    :param connect_timeout: the seconds to wait for a connection to be established, ``None`` to wait forever
+    :param read_timeout: the seconds to wait for data from a connection, ``None`` to wait forever
+    :param keepalive: whether to turn on TCP keep-alive
+    :param counter: the :class:`TransferCounter` counting the bytes received
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, keepalive=True, counter=None):
+        super().__init__(read_timeout)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive = keepalive
+        self.counter = counter or TransferCounter()
+        self.ssl_context = ssl.create_default_context()
+        self._tls_sessions = {}
+        self._tls_sessions_lock = threading.Lock()
+
+    def prepare_socket(self, sock):
+        if self.keepalive:
+            _set_keepalive(sock)
+
+    def get_tls_session(self, host):
+        with self._tls_sessions_lock:
+            return self._tls_sessions.get(host)
+
+    def get(self, url):
+        scheme, host = util.urlsplit(url, 'http', False)[:2]
+        with self.lock:
+            conns = self.conns.setdefault((scheme, host), [])
+            conn = conns.pop() if conns else None
+
+        if conn is None:
+            if scheme == 'http':
+                conn = HTTPConnection(host, self)
+            elif scheme == 'https':
+                conn = HTTPSConnection(host, self)
+            else:
+                raise ValueError('%s is not a supported scheme' % scheme)
+            conn.connect()
+        return conn
+
+    def release(self, url, conn):
+        scheme, host = util.urlsplit(url, 'http', False)[:2]
+        if _CAN_RESUME_TLS_SESSIONS and isinstance(conn.sock, ssl.SSLSocket) and conn.sock.session is not None:
+            # TLS 1.3 only hands out the session after the handshake, so it's kept once a response is read
+            with self._tls_sessions_lock:
+                self._tls_sessions[conn.host] = conn.sock.session
+
+        with self.lock:
+            conns = self.conns.setdefault((scheme, host), [])
+            if len(conns) < self.pool_size:
+                conns.append(conn)
+                return
+        conn.close()
+
+
+class Session(couchdb.http.Session):
+    """A couchdb-python session over a :class:`ConnectionPool`, see it for the other parameters.
+
+    :param accept_gzip: whether to ask for gzip compressed responses
+    :param compress_requests: whether to gzip request bodies of ``COMPRESS_MIN_SIZE`` bytes or more. A server
+                              that answers those with ``415 Unsupported Media Type`` gets uncompressed bodies
+                              from then on.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, keepalive=True, accept_gzip=True, compress_requests=False,
+                 counter=None):
+        super().__init__(timeout=read_timeout)
+        self.connection_pool = ConnectionPool(pool_size, connect_timeout, read_timeout, keepalive, counter)
+        self.accept_gzip = accept_gzip
+        self.compress_requests = compress_requests
+        self._uncompressed_hosts = set()
+
+    @property
+    def counter(self):
+        return self.connection_pool.counter
+
+    def copy(self, **settings):
+        """Return a session with the settings of this one, except for the given ``settings``, e.g., ``read_timeout``.
+
+        The new session has connections of its own, but shares the counter of this one.
+        """
+        pool = self.connection_pool
+        settings = dict(dict(pool_size=pool.pool_size, connect_timeout=pool.connect_timeout,
+                             read_timeout=pool.read_timeout, keepalive=pool.keepalive, accept_gzip=self.accept_gzip,
+                             compress_requests=self.compress_requests, counter=pool.counter), **settings)
+        return Session(**settings)
+
+    def request(self, method, url, body=None, headers=None, credentials=None, num_redirects=0):
+        headers = dict(headers or {})
+        if self.accept_gzip and not _STREAMING_FEED_RE.search(url):
+            headers.setdefault('Accept-Encoding', 'gzip')
+
+        if body is not None and not isinstance(body, util.strbase) and not hasattr(body, 'read'):
+            body = couchdb.json.encode(body).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+
+        host = util.urlsplit(url)[1]
+        compress = self.compress_requests and host not in self._uncompressed_hosts
+        if compress and 'Content-Encoding' not in headers and isinstance(body, util.strbase) \
+                and len(body) >= COMPRESS_MIN_SIZE:
+            compressed_body = gzip.compress(body.encode('utf-8') if isinstance(body, str) else body)
+            try:
+                return self._request(method, url, compressed_body, dict(headers, **{'Content-Encoding': 'gzip'}),
+                                     credentials, num_redirects)
+            except couchdb.ServerError as e:
+                status, _ = e.args[0]
+                if status != 415:
+                    raise
+                self._uncompressed_hosts.add(host)
+
+        return self._request(method, url, body, headers, credentials, num_redirects)
+
+    def _request(self, method, url, body, headers, credentials, num_redirects):
+        self.counter.add(requests=1, sent=len(body) if isinstance(body, util.strbase) else 0)
+        return super().request(method, url, body, headers, credentials, num_redirects)
+
+    def disable_ssl_verification(self):
+        self.connection_pool.ssl_context.check_hostname = False
+        self.connection_pool.ssl_context.verify_mode = ssl.CERT_NONE
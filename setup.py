@@ -23,9 +23,12 @@ setuptools.setup(
         'Development Status :: 4 - Beta',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.6',
     ],
+    python_requires='>=3.6',
     entry_points={
         'console_scripts': [
             'cdbcli=cdbcli.main:main'
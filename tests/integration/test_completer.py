@@ -1,5 +1,6 @@
 from tests.integration.fixtures import *  # noqa
 from cdbcli import completer
+from cdbcli.repl import eval_
 
 
 def test_fetch_view_path_no_current_db(environment, couch_server):
@@ -15,6 +16,16 @@ def test_fetch_view_path_with_current_db(environment, couch_server):
     assert set(['_design/users:by_lastname', '_design/users:by_firstname']) == set(view_paths)
 
 
+def test_fetch_view_path_skips_design_docs_without_views(environment, couch_server):
+    db = couch_server.create('test')
+    db.save(get_user_design_doc())
+    db.save(get_empty_design_doc())
+    db.save(get_user_doc('john', 'smith'))
+    environment.current_db = db
+    view_paths = completer.fetch_view_paths(environment, couch_server)
+    assert set(['_design/users:by_lastname', '_design/users:by_firstname']) == set(view_paths)
+
+
 def test_fetch_view_ids_no_current_db(environment, couch_server):
     view_paths = completer.fetch_view_ids(environment, couch_server)
     assert [] == view_paths
@@ -48,3 +59,22 @@ def test_fetch_doc_ids_with_current_db(environment, couch_server):
     environment.current_db = db
     doc_ids = completer.fetch_doc_ids(environment, couch_server)
     assert set(['jane.doe', 'john.smith']) == set(doc_ids)
+
+
+def test_fetch_cached_doc_ids_follows_own_writes(environment, couch_server):
+    db = couch_server.create('test')
+    db.save(get_user_doc('john', 'smith'))
+    environment.current_db = db
+    assert ['john.smith'] == completer.fetch_cached_doc_ids(environment, couch_server)
+    db.save(get_user_doc('jane', 'doe'))
+    assert ['john.smith'] == completer.fetch_cached_doc_ids(environment, couch_server)
+    eval_(environment, couch_server, 'touch finding_nemo')
+    eval_(environment, couch_server, 'rm john.smith')
+    assert ['finding_nemo'] == completer.fetch_cached_doc_ids(environment, couch_server)
+
+
+def test_fetch_cached_db_names_follows_mkdir(environment, couch_server):
+    completer.fetch_cached('db_names', completer.fetch_db_names, environment, couch_server)
+    eval_(environment, couch_server, 'mkdir test')
+    db_names = completer.fetch_cached('db_names', completer.fetch_db_names, environment, couch_server)
+    assert 'test' in db_names
@@ -1,14 +1,19 @@
+import couchdb
 import functools
+import gzip
 import io
 import json
+import re
 import tempfile
 import pytest
 import retrying
 
 from unittest.mock import Mock
 
+from cdbcli.aio import Runner
 from cdbcli.repl import eval_, Repl
 from cdbcli.commands import command_handler, COMMANDS
+from cdbcli.index import DocIndex
 from tests.integration.fixtures import *  # noqa
 
 
@@ -17,6 +22,11 @@ def _get_output(environment):
     return environment.output_stream.read()
 
 
+def _get_plain_output(environment):
+    """Return the output without the highlighting."""
+    return re.sub(r'\x1b\[[0-9;]*m', '', _get_output(environment))
+
+
 @retrying.retry(stop_max_delay=10000, wait_fixed=1000)
 def _get_pipe_output(pipe_output_temp_file_path, expect_empty_output=False):  # pragma: nocover
     with io.open(pipe_output_temp_file_path, 'r') as f:
@@ -34,7 +44,7 @@ def _assert_command_requires_current_db(command, environment, couch_server):
     assert str(e.value) == 'No database selected.'
 
 
-for command in ['exec blah', 'lv blah', 'vim blah', 'touch blah', 'info', 'cat blah', 'rm blah']:
+for command in ['exec blah', 'lv blah', 'vim blah', 'touch blah', 'info', 'cat blah', 'rm blah', 'stat blah']:
     test_name = 'test_requires_current_db_for_command_{}'.format(command.replace(' ', '_'))
     globals()[test_name] = functools.partial(_assert_command_requires_current_db, command)
 
@@ -133,6 +143,14 @@ def test_ls_shows_all_dbs_if_no_current_db(environment, couch_server):
     assert '_users' in output[1]
 
 
+def test_ls_with_options_lists_matching_dbs_if_no_current_db(environment, couch_server):
+    for db_name in ['test1', 'test2', 'test3']:
+        couch_server.create(db_name)
+    eval_(environment, couch_server, 'ls test --start test2 --limit 1')
+    output = _get_output(environment).split()
+    assert ['0', 'test2'] == output
+
+
 def test_ls_shows_no_doc_if_no_doc(environment, couch_server):
     db = couch_server.create('test')
     environment.current_db = db
@@ -161,6 +179,58 @@ def test_ls_shows_all_docs_if_current_db_is_set(environment, couch_server):
     assert expected == set(output)
 
 
+def _create_presidents_db(couch_server):
+    db = couch_server.create('test')
+    [db.save(get_user_doc(first_name, last_name))
+     for first_name, last_name in [('george', 'washington'),
+                                   ('thomas', 'jefferson'),
+                                   ('john', 'adams'),
+                                   ('john', 'quincy')]
+     ]
+    return db
+
+
+def test_ls_with_limit(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'ls --limit 2')
+    output = _get_output(environment).splitlines()
+    assert ['d george.washington', 'd john.adams'] == output
+
+
+def test_ls_with_doc_id_prefix(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'ls john.')
+    output = _get_output(environment).splitlines()
+    assert ['d john.adams', 'd john.quincy'] == output
+
+
+def test_ls_with_start(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'ls --start john.b')
+    output = _get_output(environment).splitlines()
+    assert ['d john.quincy', 'd thomas.jefferson'] == output
+
+
+def test_ls_pages_through_all_docs(environment, couch_server, mocker):
+    mocker.patch('cdbcli.commands.ALL_DOCS_PAGE_SIZE', 1)
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'ls')
+    output = _get_output(environment).splitlines()
+    assert 4 == len(output)
+
+
+def test_ls_and_rm_use_doc_index(environment, couch_server, tmpdir):
+    environment.doc_index = DocIndex(str(tmpdir.join('index.db')))
+    _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'cd test')
+    environment.current_db.save({'_id': 'john.tyler'})
+    eval_(environment, couch_server, 'rm john.*')
+    eval_(environment, couch_server, 'ls')
+    output = _get_output(environment).splitlines()
+    assert ['Deleted 3 documents', 'd george.washington', 'd thomas.jefferson'] == output
+    assert [] == list(environment.doc_index.iter_docs(environment.current_db, 'john.', 'john.\ufff0'))
+
+
 def test_cat_raises_error_when_no_docid_specified(environment, couch_server):
     with pytest.raises(RuntimeError):
         eval_(environment, couch_server, 'cat')
@@ -183,6 +253,140 @@ def test_cat_shows_doc_content(environment, couch_server):
     assert doc_id in output
 
 
+def test_cat_shows_several_docs_and_reports_missing_ones(environment, couch_server, mocker):
+    environment.current_db = _create_presidents_db(couch_server)
+    environment.aio = Runner()
+    post_json = mocker.spy(environment.aio.client(environment.current_db), 'post_json')
+    eval_(environment, couch_server, 'cat george.washington john.smith thomas.jefferson --ndjson')
+    environment.aio.close()
+    output = [json.loads(line) for line in _get_output(environment).splitlines()]
+    assert ['george.washington', 'john.smith', 'thomas.jefferson'] == [doc.get('_id', doc.get('id')) for doc in output]
+    assert 'not_found' == output[1]['error']
+    assert 1 == post_json.call_count
+    assert ('_all_docs',) == post_json.call_args[0]
+    assert ['george.washington', 'john.smith', 'thomas.jefferson'] == post_json.call_args[1]['body']['keys']
+
+
+def test_cat_shows_docs_matching_glob(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'cat john.* --ndjson')
+    output = _get_output(environment).splitlines()
+    assert ['john.adams', 'john.quincy'] == [json.loads(line)['_id'] for line in output]
+
+
+def test_stat_shows_rev_and_size_without_fetching_the_doc(environment, couch_server, mocker):
+    db = couch_server.create('test')
+    doc_id, rev = db.save({'_id': '_design/users', 'views': {}})
+    environment.current_db = db
+    get = mocker.spy(db, 'get')
+    eval_(environment, couch_server, 'stat _design/users')
+    output = json.loads(_get_plain_output(environment))
+    assert {'id': doc_id, 'rev': rev} == {'id': output['id'], 'rev': output['rev']}
+    assert output['size'] > 0
+    assert 0 == get.call_count
+
+
+def test_stat_raises_error_when_no_doc_matching_id(environment, couch_server):
+    environment.current_db = couch_server.create('test')
+    with pytest.raises(RuntimeError):
+        eval_(environment, couch_server, 'stat cafebabe')
+
+
+def test_dump_writes_docs_as_ndjson(environment, couch_server, tmpdir):
+    environment.current_db = _create_presidents_db(couch_server)
+    file_path = str(tmpdir.join('presidents.ndjson.gz'))
+    eval_(environment, couch_server, 'dump {} --page-size 3'.format(file_path))
+    with gzip.open(file_path, 'rt') as f:
+        doc_ids = [json.loads(line)['_id'] for line in f]
+    assert ['george.washington', 'john.adams', 'john.quincy', 'thomas.jefferson'] == doc_ids
+
+
+def test_dump_resumes_after_last_dumped_doc(environment, couch_server, tmpdir):
+    environment.current_db = _create_presidents_db(couch_server)
+    dump_file = tmpdir.join('presidents.ndjson')
+    dump_file.write('{"_id": "john.adams"}\n{"_id": "john.q')
+    eval_(environment, couch_server, 'dump {} --resume'.format(str(dump_file)))
+    doc_ids = [json.loads(line)['_id'] for line in dump_file.readlines()]
+    assert ['john.adams', 'john.quincy', 'thomas.jefferson'] == doc_ids
+    assert 'Dumped 2 documents' in _get_output(environment)
+
+
+def test_load_saves_docs_in_batches(environment, couch_server, tmpdir):
+    environment.current_db = couch_server.create('test')
+    load_file = tmpdir.join('docs.json')
+    load_file.write(json.dumps([{'_id': 'doc{}'.format(i), '_rev': '1-abc'} for i in range(5)]))
+    eval_(environment, couch_server, 'load {} --batch-size 2 --concurrency 2'.format(str(load_file)))
+    output = _get_output(environment).splitlines()
+    assert 4 == len(output)
+    assert output[-1].startswith('Loaded 5 documents')
+    assert 5 == environment.current_db.info()['doc_count']
+
+
+def test_load_keeps_revisions_of_dump(environment, couch_server, tmpdir):
+    db = _create_presidents_db(couch_server)
+    environment.current_db = db
+    dump_file = str(tmpdir.join('presidents.ndjson'))
+    eval_(environment, couch_server, 'dump {}'.format(dump_file))
+    environment.current_db = couch_server.create('test_copy')
+    eval_(environment, couch_server, 'load {} --keep-rev'.format(dump_file))
+    assert db['john.adams']['_rev'] == environment.current_db['john.adams']['_rev']
+
+
+def test_cp_replicates_database(environment, couch_server):
+    _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'cp test test_copy')
+    assert 4 == couch_server['test_copy'].info()['doc_count']
+
+
+def test_cp_copies_docs_with_prefix(environment, couch_server):
+    _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'cp test test_copy --prefix john. --batch-size 1')
+    assert ['john.adams', 'john.quincy'] == [row.id for row in couch_server['test_copy'].view('_all_docs')]
+    assert _get_output(environment).splitlines()[-1] == 'Copied 2 documents from test to test_copy'
+
+
+def test_cp_copies_doc(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'cp john.adams john.q.adams')
+    assert environment.current_db['john.q.adams']['first_name'] == 'john'
+
+
+def test_cp_raises_error_when_destination_doc_exists(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    with pytest.raises(RuntimeError):
+        eval_(environment, couch_server, 'cp john.adams john.quincy')
+
+
+def test_find_follows_bookmarks(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server,
+          """find '{"first_name": "john"}' --fields _id --sort _id:desc --page-size 1 | jq ._id""")
+    output = _get_plain_output(environment).splitlines()
+    assert ['"john.quincy"', '"john.adams"'] == output
+
+
+def test_find_raises_error_on_invalid_selector(environment, couch_server):
+    environment.current_db = couch_server.create('test')
+    with pytest.raises(RuntimeError):
+        eval_(environment, couch_server, 'find {first_name}')
+
+
+def test_tail_shows_last_changes(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'tail')
+    output = [json.loads(line) for line in _get_plain_output(environment).splitlines()]
+    assert ['george.washington', 'thomas.jefferson', 'john.adams', 'john.quincy'] == [c['id'] for c in output]
+
+
+def test_tail_shows_changes_since_seq(environment, couch_server, mocker):
+    mocker.patch('cdbcli.commands.CHANGES_PAGE_SIZE', 1)
+    environment.current_db = _create_presidents_db(couch_server)
+    since = environment.current_db.changes(limit=2)['last_seq']
+    eval_(environment, couch_server, 'tail --since {} --include-docs'.format(json.dumps(since)))
+    output = [json.loads(line) for line in _get_plain_output(environment).splitlines()]
+    assert ['john.adams', 'john.quincy'] == [c['doc']['_id'] for c in output]
+
+
 def test_exit_raises_eof_error(environment, couch_server):
     with pytest.raises(EOFError):
         eval_(environment, couch_server, 'exit')
@@ -238,6 +442,33 @@ def test_exec_view(environment, couch_server, mocker):
     assert expected == actual
 
 
+def _exec_keys(environment, couch_server, command_text):
+    environment.output = Mock()
+    eval_(environment, couch_server, command_text)
+    return [json.loads(c[0][0])['key'] for c in environment.output.call_args_list]
+
+
+def test_exec_view_with_query_options(environment, couch_server):
+    db = _create_presidents_db(couch_server)
+    db.save(get_user_design_doc())
+    environment.current_db = db
+    keys = _exec_keys(environment, couch_server, 'exec _design/users:by_firstname --descending --limit 3')
+    assert ['thomas', 'john', 'john'] == keys
+    keys = _exec_keys(environment, couch_server, 'exec _design/users:by_firstname --key john')
+    assert ['john', 'john'] == keys
+    keys = _exec_keys(environment, couch_server, 'exec _design/users:by_firstname --startkey h --skip 1')
+    assert ['john', 'thomas'] == keys
+
+
+def test_exec_view_pages_through_rows(environment, couch_server, mocker):
+    mocker.patch('cdbcli.commands.VIEW_PAGE_SIZE', 1)
+    db = _create_presidents_db(couch_server)
+    db.save(get_user_design_doc())
+    environment.current_db = db
+    keys = _exec_keys(environment, couch_server, 'exec _design/users:by_firstname')
+    assert ['george', 'john', 'john', 'thomas'] == keys
+
+
 def test_lv_requires_real_view_doc_id(environment, couch_server):
     db = couch_server.create('test')
     db.save(get_user_design_doc())
@@ -254,6 +485,18 @@ def test_lv_lists_views_inside_view_doc(environment, couch_server):
     # TODO: assert map function is displayed
 
 
+def test_lv_without_view_doc_id_lists_views_of_all_view_docs(environment, couch_server):
+    db = couch_server.create('test')
+    db.save(get_user_design_doc())
+    db.save(get_empty_design_doc())
+    environment.current_db = db
+    eval_(environment, couch_server, 'lv')
+    output = _get_output(environment)
+    assert '_design/users:by_lastname' in output
+    assert '_design/users:by_firstname' in output
+    assert '_design/empty' not in output
+
+
 def test_lv_no_view(environment, couch_server):
     db = couch_server.create('test')
     db.save(get_empty_design_doc())
@@ -366,6 +609,42 @@ def test_rm_raises_exception_if_no_doc_provided(environment, couch_server):
         eval_(environment, couch_server, 'rm')
 
 
+def test_rm_removes_several_documents_in_batches(environment, couch_server, mocker):
+    environment.current_db = _create_presidents_db(couch_server)
+    update = mocker.spy(environment.current_db, 'update')
+    eval_(environment, couch_server, 'rm george.washington john.* --batch-size 2')
+    output = _get_output(environment).splitlines()
+    assert ['Deleted 2 documents', 'Deleted 3 documents'] == output
+    assert 2 == update.call_count
+    assert ['thomas.jefferson'] == [row.id for row in environment.current_db.view('_all_docs')]
+
+
+def test_rm_reports_missing_documents(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'rm john.smith john.adams')
+    output = _get_output(environment).splitlines()
+    assert ['Document not found: john.smith', 'Deleted 1 documents'] == output
+
+
+def test_rm_and_cat_take_literal_ids_after_double_dash(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    environment.current_db.save({'_id': '-john.*'})
+    eval_(environment, couch_server, 'cat --ndjson -- -john.*')
+    assert ['-john.*'] == [json.loads(line)['_id'] for line in _get_output(environment).splitlines()]
+    eval_(environment, couch_server, 'rm -- -john.*')
+    assert 5 - 1 == environment.current_db.info()['doc_count']
+
+
+def test_rm_reads_ids_from_file(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    _, file_path = tempfile.mkstemp()
+    with io.open(file_path, 'w') as f:
+        f.write('john.adams\n\njohn.quincy\n')
+    eval_(environment, couch_server, 'rm --from-file {}'.format(file_path))
+    output = _get_output(environment).splitlines()
+    assert ['Deleted 2 documents'] == output
+
+
 def test_pipe_commands_one_pipe(environment, couch_server):
     db = couch_server.create('test')
     [db.save(get_user_doc(first_name, last_name))
@@ -400,6 +679,23 @@ def test_pipe_commands_multiple_pipes(environment, couch_server):
     assert {'william', 'bill'} == set(map(str.strip, output))
 
 
+def test_pipe_builtin_head_fetches_only_what_it_outputs(environment, couch_server, mocker):
+    environment.current_db = _create_presidents_db(couch_server)
+    view = mocker.spy(environment.current_db, 'view')
+    eval_(environment, couch_server, 'ls | head 2')
+    output = _get_output(environment).splitlines()
+    assert ['d george.washington', 'd john.adams'] == output
+    assert 1 == view.call_count
+    assert 3 == view.call_args[1]['limit']
+
+
+def test_pipe_builtin_filters(environment, couch_server):
+    environment.current_db = _create_presidents_db(couch_server)
+    eval_(environment, couch_server, 'ls | jq .id | grep john | wc -l')
+    output = _get_output(environment).splitlines()
+    assert ['2'] == output
+
+
 def test_pipe_error(environment, couch_server):
     db = couch_server.create('test')
     environment.current_db = db
@@ -422,6 +718,16 @@ def test_du_command_no_database_selected(environment, couch_server):
     assert 'test' in output[2]
 
 
+def test_du_command_falls_back_when_dbs_info_not_supported(environment, couch_server, mocker):
+    couch_server.create('test')
+    mocker.patch('cdbcli.commands._get_dbs_info', side_effect=couchdb.ServerError((400, ('bad_request', ''))))
+    eval_(environment, couch_server, 'du')
+    output = _get_output(environment).splitlines()
+    assert '_replicator' in output[0]
+    assert '_users' in output[1]
+    assert 'test' in output[2]
+
+
 def test_du_command_with_database_selected(environment, couch_server):
     db = couch_server.create('test')
     environment.current_db = db
@@ -455,5 +761,5 @@ def test_repl_prompt_non_admin(environment, non_admin_couch_server):
 
 def test_repl_prompt_admin(environment, couch_server):
     config = Mock(username='admin', host='localhost', database=None)
-    repl = Repl(non_admin_couch_server, config, environment)
+    repl = Repl(couch_server, config, environment)
     assert 'admin@localhost/ # ' == repl.prompt
@@ -0,0 +1,67 @@
+import contextlib
+import gzip
+import http.server
+import json
+import socketserver
+import threading
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Serve every request from a thread of its own, like ``http.server.ThreadingHTTPServer`` of Python 3.7."""
+    daemon_threads = True
+
+
+class JSONRequestHandler(http.server.BaseHTTPRequestHandler):
+    """A keep-alive request handler answering in JSON, gzip compressed if the client accepts it."""
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, value, chunked=False):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 10):
+                chunk = body[i:i + 10]
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve(handler_class, **attributes):
+    """Serve ``handler_class`` on a local port from a background thread, for the length of the ``with`` block.
+
+    The server counts its ``connections`` and has its ``url`` and the given ``attributes`` set, e.g., for the
+    handler to read.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.connections = 0
+    for name, value in attributes.items():
+        setattr(server, name, value)
+    get_request = server.get_request
+
+    def counting_get_request():
+        server.connections += 1
+        return get_request()
+
+    server.get_request = counting_get_request
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,211 @@
+import gzip
+import io
+import json
+import socket
+import threading
+import time
+
+import couchdb
+import pytest
+
+from cdbcli import aio
+from cdbcli.environment import Environment
+from cdbcli.repl import eval_
+from cdbcli.session import Session
+from tests.unit.fixtures import JSONRequestHandler, serve
+
+
+DATABASES = {'db{}'.format(i): {'db_name': 'db{}'.format(i), 'doc_count': i, 'disk_size': 1024} for i in range(10)}
+DOCS = {'doc{}'.format(i): {'_id': 'doc{}'.format(i), '_rev': '1-a', 'n': i} for i in range(10)}
+
+
+class StandInCouchHandler(JSONRequestHandler):
+    """Just enough of couchdb for the asyncio client."""
+    def send_json(self, status, value, chunked=False):
+        super().send_json(status, value, chunked)
+        if self.server.close_after_response:
+            self.close_connection = True  # without telling the client
+
+    def _track_request(self):
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.in_flight += 1
+            self.server.peak_in_flight = max(self.server.peak_in_flight, self.server.in_flight)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.in_flight -= 1
+
+    def do_GET(self):
+        self._track_request()
+        path = self.path.lstrip('/')
+        if path == '_all_dbs':
+            self.send_json(200, sorted(DATABASES))
+        elif path == 'chunked':
+            self.send_json(200, {'rows': sorted(DOCS)}, chunked=True)
+        elif path in DATABASES:
+            self.send_json(200, DATABASES[path])
+        elif path == '':
+            self.send_json(200, {'couchdb': 'Welcome', 'version': '2.3.1'})
+        elif path == 'dropped':
+            self.close_connection = True
+        elif path == 'cut_short':
+            self.send_response(200)
+            self.send_header('Content-Length', '100')
+            self.end_headers()
+            self.wfile.write(b'{"rows": [')
+            self.close_connection = True
+        elif path == 'proxied':
+            body = b'<html><body>Bad Gateway</body></html>'
+            self.send_response(502)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {'error': 'not_found', 'reason': 'missing'})
+
+    def do_HEAD(self):
+        self.send_response(200 if self.path.lstrip('/') in DATABASES else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        self._track_request()
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posted.append(self.headers.get('Content-Encoding'))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if self.server.reject_gzip:
+                self.send_json(415, {'error': 'bad_content_type', 'reason': 'gzip'})
+                return
+            body = gzip.decompress(body)
+        body = json.loads(body.decode())
+        path = self.path.split('?')[0].lstrip('/')
+        if path == '_dbs_info':
+            self.send_json(400, {'error': 'bad_request', 'reason': 'unsupported'})
+        elif path.endswith('/_all_docs'):
+            include_docs = 'include_docs=true' in self.path
+            rows = [{'id': key, 'key': key, 'value': {'rev': DOCS[key]['_rev']},
+                     'doc': DOCS[key] if include_docs else None} if key in DOCS else {'key': key, 'error': 'not_found'}
+                    for key in body['keys']]
+            self.send_json(200, {'rows': rows})
+        else:
+            self.send_json(404, {'error': 'not_found', 'reason': 'missing'})
+
+
+@pytest.fixture
+def stand_in_couch():
+    with serve(StandInCouchHandler, lock=threading.Lock(), requests=0, in_flight=0, peak_in_flight=0, delay=0,
+               close_after_response=False, posted=[], reject_gzip=False) as server:
+        yield server
+
+
+@pytest.fixture
+def runner():
+    runner = aio.Runner()
+    yield runner
+    runner.close()
+
+
+def test_client_reuses_connections(stand_in_couch, runner):
+    client = runner.client(couchdb.Server(stand_in_couch.url))
+    for db_name in ['db1', 'db2', 'db3']:
+        assert DATABASES[db_name] == runner.run(client.get_json(db_name))
+    assert sorted(DOCS) == runner.run(client.get_json('chunked'))['rows']
+    assert 1 == stand_in_couch.connections
+
+
+def test_client_retries_on_closed_idle_connection(stand_in_couch, runner):
+    stand_in_couch.close_after_response = True
+    client = runner.client(couchdb.Server(stand_in_couch.url))
+    for db_name in ['db1', 'db2']:
+        assert DATABASES[db_name] == runner.run(client.get_json(db_name))
+    assert 2 == stand_in_couch.requests
+
+
+def test_client_raises_couchdb_errors(stand_in_couch, runner):
+    client = runner.client(couchdb.Server(stand_in_couch.url))
+    with pytest.raises(couchdb.ResourceNotFound):
+        runner.run(client.get_json('missing'))
+    with pytest.raises(couchdb.ServerError) as e:
+        runner.run(client.post_json('_dbs_info', body={'keys': []}))
+    assert (400, ('bad_request', 'unsupported')) == e.value.args[0]
+
+
+@pytest.mark.parametrize('path', ['dropped', 'cut_short'])
+def test_client_raises_connection_error_when_connection_closes_early(stand_in_couch, runner, path):
+    client = runner.client(couchdb.Server(stand_in_couch.url))
+    with pytest.raises(ConnectionError):
+        runner.run(client.get_json(path))
+
+
+def test_client_raises_errors_of_non_json_responses(stand_in_couch, runner):
+    client = runner.client(couchdb.Server(stand_in_couch.url))
+    with pytest.raises(couchdb.ServerError) as e:
+        runner.run(client.get_json('proxied'))
+    assert (502, ('unknown_error', '<html><body>Bad Gateway</body></html>')) == e.value.args[0]
+
+
+def test_client_counts_bytes_in_session_counter(stand_in_couch, runner):
+    session = Session()
+    client = runner.client(couchdb.Server(stand_in_couch.url, session=session))
+    runner.run(client.get_json('chunked'))
+    stats = session.counter.reset()
+    assert 1 == stats.requests
+    assert len(json.dumps({'rows': sorted(DOCS)})) == stats.decoded
+    assert 0 < stats.received
+
+
+def test_client_takes_session_settings(stand_in_couch, runner):
+    session = Session(pool_size=3, connect_timeout=5, read_timeout=7, keepalive=True, accept_gzip=False)
+    client = runner.client(couchdb.Server(stand_in_couch.url, session=session))
+    assert (3, 5, 7, True, False) == (client.pool_size, client.connect_timeout, client.read_timeout,
+                                      client.keepalive, client.accept_gzip)
+    runner.run(client.get_json('db1'))
+    _, writer = client._idle[0]
+    assert writer.get_extra_info('socket').getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+
+@pytest.mark.parametrize('reject_gzip,expected', [
+    (False, [None, 'gzip', 'gzip']),
+    (True, [None, 'gzip', None, None]),
+])
+def test_client_compresses_large_request_bodies(stand_in_couch, runner, reject_gzip, expected):
+    stand_in_couch.reject_gzip = reject_gzip
+    client = runner.client(couchdb.Server(stand_in_couch.url + 'db1', session=Session(compress_requests=True)))
+    keys = ['doc{}'.format(i) for i in range(10)]
+    for keys in [keys[:2], keys * 20, keys * 20]:
+        rows = runner.run(client.post_json('_all_docs', body={'keys': keys}))['rows']
+        assert keys == [row['key'] for row in rows]
+    assert expected == stand_in_couch.posted
+
+
+def test_gather_limits_concurrency_and_keeps_order(stand_in_couch, runner):
+    stand_in_couch.delay = 0.05
+    client = runner.client(couchdb.Server(stand_in_couch.url))
+    infos = runner.run(aio.gather([client.get_json(db_name) for db_name in sorted(DATABASES)], limit=3))
+    assert [DATABASES[db_name] for db_name in sorted(DATABASES)] == infos
+    assert 1 < stand_in_couch.peak_in_flight <= 3
+
+
+def test_eval_fans_out_database_infos_and_doc_reads(stand_in_couch, mocker):
+    mocker.patch('cdbcli.commands.DBS_INFO_BATCH_SIZE', 4)
+    mocker.patch('cdbcli.commands.BULK_DOCS_BATCH_SIZE', 2)
+    stand_in_couch.delay = 0.05
+    environment = Environment(output_stream=io.StringIO())
+    environment.has_pipe = True  # no highlighting
+    couch_server = couchdb.Server(stand_in_couch.url)
+
+    eval_(environment, couch_server, 'ls')
+    assert ['{:>10} {}'.format(i, 'db{}'.format(i)) for i in range(10)] == \
+        environment.output_stream.getvalue().splitlines()
+    assert 1 < stand_in_couch.peak_in_flight
+
+    environment.output_stream = io.StringIO()
+    stand_in_couch.peak_in_flight = 0
+    environment.current_db = couch_server['db1']
+    eval_(environment, couch_server, 'cat doc1 doc2 doc3 missing doc4 --ndjson')
+    assert [json.dumps(DOCS['doc{}'.format(i)], sort_keys=True) for i in range(1, 4)] + [
+        json.dumps({'error': 'not_found', 'id': 'missing'}, sort_keys=True), json.dumps(DOCS['doc4'], sort_keys=True)
+    ] == environment.output_stream.getvalue().splitlines()
+    assert 1 < stand_in_couch.peak_in_flight
+    environment.aio.close()
@@ -0,0 +1,104 @@
+from unittest.mock import Mock
+
+from cdbcli.cache import CompletionCache, cache_key
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _fetch(words):
+    return Mock(return_value=list(words))
+
+
+def test_cache_key_uses_database_name():
+    couch_server = Mock()
+    couch_server.resource.url = 'http://localhost:5984'
+    database = Mock()
+    database.name = 'test'
+    assert ('http://localhost:5984', 'test', 'doc_ids') == cache_key(couch_server, database, 'doc_ids')
+    assert ('http://localhost:5984', None, 'db_names') == cache_key(couch_server, None, 'db_names')
+
+
+def test_get_fetches_once_within_ttl():
+    clock = FakeClock()
+    cache = CompletionCache(ttl=10, clock=clock)
+    fetch = _fetch(['b', 'a'])
+    assert ['a', 'b'] == cache.get('key', fetch)
+    clock.now = 9
+    assert ['a', 'b'] == cache.get('key', fetch)
+    assert 1 == fetch.call_count
+
+
+def test_get_refetches_after_ttl():
+    clock = FakeClock()
+    cache = CompletionCache(ttl=10, clock=clock)
+    fetch = _fetch(['a'])
+    cache.get('key', fetch)
+    clock.now = 10
+    cache.get('key', fetch)
+    assert 2 == fetch.call_count
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = CompletionCache(max_size=2)
+    cache.get('a', _fetch([]))
+    cache.get('b', _fetch([]))
+    cache.get('a', _fetch([]))
+    cache.get('c', _fetch([]))
+    assert 2 == len(cache)
+    fetch = _fetch([])
+    cache.get('a', fetch)
+    assert 0 == fetch.call_count
+    cache.get('b', fetch)
+    assert 1 == fetch.call_count
+
+
+def test_add_and_discard_update_cached_entry():
+    cache = CompletionCache()
+    cache.get('key', _fetch(['a', 'c']))
+    cache.add('key', 'b')
+    cache.add('key', 'b')
+    cache.discard('key', 'c')
+    cache.discard('key', 'x')
+    assert ['a', 'b'] == cache.get('key', _fetch([]))
+
+
+def test_discard_drops_truncated_entry():
+    cache = CompletionCache()
+    cache.get('complete', _fetch(['a', 'b']))
+    cache.get('truncated', _fetch(['a', 'b', 'c']))
+    cache.discard('complete', 'a', complete_below=3)
+    cache.discard('truncated', 'a', complete_below=3)
+    assert ['b'] == cache.lookup('complete')
+    assert cache.lookup('truncated') is None
+
+
+def test_add_does_not_create_entry():
+    cache = CompletionCache()
+    cache.add('key', 'a')
+    assert 0 == len(cache)
+
+
+def test_invalidate_drops_entry():
+    cache = CompletionCache()
+    cache.get('key', _fetch(['a']))
+    cache.invalidate('key')
+    fetch = _fetch(['b'])
+    assert ['b'] == cache.get('key', fetch)
+    assert 1 == fetch.call_count
+
+
+def test_invalidate_prefix_drops_matching_entries():
+    cache = CompletionCache()
+    cache.get(('url', 'db1', 'doc_ids'), _fetch(['a']))
+    cache.get(('url', 'db1', 'view_ids'), _fetch(['a']))
+    cache.get(('url', 'db2', 'doc_ids'), _fetch(['a']))
+    cache.invalidate_prefix(('url', 'db1'))
+    assert cache.lookup(('url', 'db1', 'doc_ids')) is None
+    assert cache.lookup(('url', 'db1', 'view_ids')) is None
+    assert ['a'] == cache.lookup(('url', 'db2', 'doc_ids'))
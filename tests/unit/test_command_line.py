@@ -1,3 +1,8 @@
+import asyncio
+import http.client
+
+import pytest
+
 import cdbcli.main as cdbcli_main
 from cdbcli import __version__
 
@@ -12,3 +17,57 @@ def test_main_with_version_toggle(mocker):
     cdbcli_main.main(['--version'])
     assert 1 == get_version_mock.call_count
     assert 1 == exit_mock.call_count
+
+
+def test_main_with_dump_exports_database(mocker):
+    mocker.patch('click.core.Context.exit')
+    server = mocker.patch('couchdb.Server')
+    dump_database = mocker.patch('cdbcli.commands.dump_database', return_value=3)
+    cdbcli_main.main(['--dump', 'test.ndjson', 'test'])
+    database = server.return_value.__getitem__.return_value
+    dump_database.assert_called_once_with(database, 'test.ndjson')
+
+
+def test_main_with_command_runs_commands_and_exits(mocker):
+    mocker.patch('couchdb.Server')
+    eval_ = mocker.patch('cdbcli.repl.eval_')
+    with pytest.raises(SystemExit) as e:
+        cdbcli_main.main(['-c', 'cd db; ls | head'])
+    assert ['cd db', 'ls | head'] == [call[0][2] for call in eval_.call_args_list]
+    assert 0 == e.value.code
+
+
+def test_main_with_file_stops_at_the_first_error(mocker, tmpdir):
+    mocker.patch('couchdb.Server')
+    eval_ = mocker.patch('cdbcli.repl.eval_', side_effect=[None, RuntimeError('Invalid input'), None])
+    script = tmpdir.join('script.cdb')
+    script.write('# make a doc\ncd db\nfoo\nls\n')
+    with pytest.raises(SystemExit) as e:
+        cdbcli_main.main(['-f', str(script)])
+    assert ['cd db', 'foo'] == [call[0][2] for call in eval_.call_args_list]
+    assert 1 == e.value.code
+
+
+@pytest.mark.parametrize('error', [
+    ConnectionResetError(104, 'Connection reset by peer'),
+    http.client.RemoteDisconnected('Remote end closed connection without response'),
+    http.client.IncompleteRead(b''),
+    asyncio.TimeoutError(),
+])
+def test_main_with_command_fails_on_connection_errors(mocker, capsys, error):
+    mocker.patch('couchdb.Server')
+    eval_ = mocker.patch('cdbcli.repl.eval_', side_effect=[None, error, None])
+    with pytest.raises(SystemExit) as e:
+        cdbcli_main.main(['-c', 'ls; ls; ls'])
+    assert 2 == eval_.call_count
+    assert 1 == e.value.code
+    assert capsys.readouterr().err.startswith('Error: ')
+
+
+def test_main_with_command_exits_on_exit(mocker):
+    mocker.patch('couchdb.Server')
+    eval_ = mocker.patch('cdbcli.repl.eval_', side_effect=[None, EOFError(), None])
+    with pytest.raises(SystemExit) as e:
+        cdbcli_main.main(['-c', 'ls; exit; ls'])
+    assert 2 == eval_.call_count
+    assert 0 == e.value.code
@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+from cdbcli import commands
+
+
+DOCS = [{'_id': 'doc{}'.format(i), 'text': 'x' * i * 10} for i in range(20)]
+
+
+@pytest.mark.parametrize('text', [
+    '\n'.join(json.dumps(doc) for doc in DOCS) + '\n',
+    json.dumps(DOCS, indent=4),
+])
+def test_iter_json_docs_reads_ndjson_and_arrays_in_chunks(text):
+    assert DOCS == list(commands.iter_json_docs(io.StringIO(text), read_size=7))
+
+
+@pytest.mark.parametrize('text', ['', '\n', '[]'])
+def test_iter_json_docs_reads_empty_input(text):
+    assert [] == list(commands.iter_json_docs(io.StringIO(text)))
+
+
+@pytest.mark.parametrize('text', ['{"_id": "a"}\n{"_id": ', '[1, 2]'])
+def test_iter_json_docs_raises_error_on_invalid_input(text):
+    with pytest.raises(RuntimeError):
+        list(commands.iter_json_docs(io.StringIO(text)))
+
+
+def test_iter_json_docs_fails_on_the_first_invalid_line():
+    class Input(io.StringIO):
+        reads = 0
+
+        def read(self, size=-1):
+            self.reads += 1
+            return super().read(size)
+
+    f = Input('{"_id": "a"}\n\n{"_id": "b", x}\n' + '{"_id": "c"}\n' * 1000)
+    with pytest.raises(RuntimeError) as e:
+        list(commands.iter_json_docs(f, read_size=16))
+    assert 'Invalid JSON on line 3: {"_id": "b", x}' == str(e.value)
+    assert f.reads < 5
+
+
+def test_iter_json_docs_fails_on_documents_larger_than_max_size():
+    f = io.StringIO('{"_id": "a"}\n{"_id": "' + 'b' * 1000)
+    with pytest.raises(RuntimeError) as e:
+        list(commands.iter_json_docs(f, read_size=16, max_doc_size=100))
+    assert 'line 2' in str(e.value)
+
+
+def test_follow_changes_reconnects_from_last_seq(mocker):
+    def changes(since, **options):
+        yield {'seq': since + 1, 'id': 'doc{}'.format(since + 1)}
+        if since == 5:
+            raise ConnectionResetError()
+        yield {'last_seq': since + 1}
+
+    database = mocker.Mock()
+    database.info.return_value = {'update_seq': 5}
+    feed_database = mocker.patch('cdbcli.commands._open_feed_database').return_value
+    feed_database.changes.side_effect = changes
+
+    follow = commands.follow_changes(database, reconnect_delay=0.01)
+    assert ['doc6', 'doc7', 'doc8'] == [next(follow)['id'] for _ in range(3)]
+    assert [5, 6, 7] == [call[1]['since'] for call in feed_database.changes.call_args_list]
+    assert all(call[1]['feed'] == 'continuous' for call in feed_database.changes.call_args_list)
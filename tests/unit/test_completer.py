@@ -0,0 +1,91 @@
+from unittest.mock import Mock
+
+from couchdb.client import Row
+from prompt_toolkit.document import Document
+
+from cdbcli import completer
+from cdbcli.environment import Environment
+
+
+def _environment():
+    environment = Environment(current_db=Mock())
+    environment.current_db.name = 'test'
+    return environment
+
+
+def test_doc_id_completer_completes_whole_typed_text():
+    fetch = Mock(return_value=['john.adams', 'john.quincy', 'jane.doe'])
+    doc_id_completer = completer.DocIdCompleter(fetch)
+    completions = list(doc_id_completer.get_completions(Document('john.'), None))
+    fetch.assert_called_once_with('john.')
+    assert ['john.adams', 'john.quincy'] == [c.text for c in completions]
+    assert all(c.start_position == -len('john.') for c in completions)
+
+
+def test_fetch_cached_doc_ids_filters_complete_shorter_prefix(mocker):
+    fetch = mocker.patch('cdbcli.completer.fetch_doc_ids', return_value=['john.adams', 'john.quincy'])
+    environment = _environment()
+    couch_server = Mock()
+    assert ['john.adams', 'john.quincy'] == completer.fetch_cached_doc_ids(environment, couch_server, 'j')
+    assert ['john.quincy'] == completer.fetch_cached_doc_ids(environment, couch_server, 'john.q')
+    assert 1 == fetch.call_count
+
+
+def test_fetch_cached_doc_ids_refetches_truncated_shorter_prefix(mocker):
+    mocker.patch('cdbcli.completer.DOC_ID_COMPLETION_LIMIT', 2)
+    fetch = mocker.patch('cdbcli.completer.fetch_doc_ids', return_value=['john.adams', 'john.quincy'])
+    environment = _environment()
+    couch_server = Mock()
+    completer.fetch_cached_doc_ids(environment, couch_server, 'j')
+    completer.fetch_cached_doc_ids(environment, couch_server, 'john.q')
+    assert 2 == fetch.call_count
+    fetch.assert_called_with(environment, couch_server, 'john.q')
+
+
+def test_current_db_completer_completes_db_names_from_root_and_doc_ids_in_db():
+    environment = _environment()
+    root_completer = completer.WordCompleter(['db'])
+    db_completer = completer.WordCompleter(['doc'])
+    current_db_completer = completer.CurrentDbCompleter(environment, root_completer, db_completer)
+    assert ['doc'] == [c.text for c in current_db_completer.get_completions(Document('d'), None)]
+    environment.current_db = None
+    assert ['db'] == [c.text for c in current_db_completer.get_completions(Document('d'), None)]
+
+
+def test_field_name_completer_completes_selector_fields():
+    field_name_completer = completer.FieldNameCompleter(lambda: ['address.city', 'age', 'name'], in_selector=True)
+    completions = list(field_name_completer.get_completions(Document('{"name": "a", "a'), None))
+    assert ['address.city', 'age'] == [c.text for c in completions]
+    assert all(c.start_position == -1 for c in completions)
+    assert [] == list(field_name_completer.get_completions(Document('{"name": "a'), None))
+
+
+def test_field_name_completer_completes_last_field_of_list():
+    field_name_completer = completer.FieldNameCompleter(lambda: ['age', 'name'])
+    assert ['name'] == [c.text for c in field_name_completer.get_completions(Document('age,n'), None)]
+    assert [] == list(field_name_completer.get_completions(Document('age:d'), None))
+
+
+def test_fetch_field_names_samples_docs():
+    environment = _environment()
+    environment.current_db.view.return_value = [
+        Row(id='_design/users', doc={'_id': '_design/users', 'views': {}}),
+        Row(id='john', doc={'_id': 'john', 'address': {'city': 'Toronto'}}),
+    ]
+    assert {'_id', 'address', 'address.city'} == completer.fetch_field_names(environment, Mock())
+    assert completer.FIELD_NAME_SAMPLE_SIZE + 1 == environment.current_db.view.call_args[1]['limit']
+
+
+def test_fetch_doc_ids_and_view_paths_from_doc_index():
+    environment = _environment()
+    environment.doc_index = Mock()
+    environment.doc_index.iter_docs.return_value = [('john.adams', '1-a'), ('john.quincy', '1-b')]
+    environment.doc_index.get_views.return_value = [('_design/users', ['by_age', 'by_name'])]
+    couch_server = Mock()
+    assert ['john.adams', 'john.quincy'] == completer.fetch_cached_doc_ids(environment, couch_server, 'john.')
+    environment.doc_index.iter_docs.assert_called_once_with(
+        environment.current_db, limit=completer.DOC_ID_COMPLETION_LIMIT, startkey='john.', endkey='john.\ufff0')
+    assert ['_design/users:by_age', '_design/users:by_name'] == completer.fetch_cached(
+        'view_paths', completer.fetch_view_paths, environment, couch_server)
+    environment.doc_index.refresh.assert_called_with(environment.current_db, completer.REFRESH_INTERVAL)
+    assert not environment.current_db.view.called
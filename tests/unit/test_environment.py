@@ -0,0 +1,113 @@
+import io
+import time
+
+from cdbcli import environment as environment_module, highlighters
+from cdbcli.environment import Environment
+
+
+def _environment(output_stream):
+    environment = Environment(output_stream=output_stream)
+    environment._last_flushed_at = time.monotonic() + 60  # keep the flush interval from kicking in
+    return environment
+
+
+def test_output_is_buffered_until_flush():
+    output_stream = io.StringIO()
+    environment = _environment(output_stream)
+    environment.output('a')
+    environment.output('b')
+    assert '' == output_stream.getvalue()
+    environment.flush()
+    assert 'a\nb\n' == output_stream.getvalue()
+
+
+def test_output_is_flushed_when_buffer_is_full(mocker):
+    mocker.patch.object(environment_module, 'OUTPUT_BUFFER_SIZE', 4)
+    output_stream = io.StringIO()
+    environment = _environment(output_stream)
+    environment.output('a')
+    assert '' == output_stream.getvalue()
+    environment.output('b')
+    assert 'a\nb\n' == output_stream.getvalue()
+
+
+def test_output_is_flushed_after_flush_interval():
+    output_stream = io.StringIO()
+    environment = Environment(output_stream=output_stream)
+    environment._last_flushed_at = time.monotonic() - environment_module.OUTPUT_FLUSH_INTERVAL
+    environment.output('a')
+    assert 'a\n' == output_stream.getvalue()
+
+
+def test_output_is_flushed_while_the_command_waits(mocker):
+    mocker.patch.object(environment_module, 'OUTPUT_FLUSH_INTERVAL', 0.01)
+    output_stream = io.StringIO()
+    environment = Environment(output_stream=output_stream)
+    environment.output('a')
+    assert '' == output_stream.getvalue()
+    time.sleep(0.1)  # e.g., waiting for the next page of rows
+    assert 'a\n' == output_stream.getvalue()
+
+
+def test_highlighted_output_is_one_line_per_record():
+    output_stream = io.StringIO()
+    environment = _environment(output_stream)
+    environment.output('{"id": "a"}', highlighters.json)
+    environment.output('{"id": "b"}', highlighters.json)
+    environment.flush()
+    assert 2 == len(output_stream.getvalue().splitlines())
+
+
+def test_output_is_encoded_for_binary_streams():
+    output_stream = io.BytesIO()
+    environment = _environment(output_stream)
+    environment.output('é')
+    environment.flush()
+    assert 'é\n'.encode('utf-8') == output_stream.getvalue()
+
+
+def test_output_is_flushed_at_the_end_of_a_command():
+    output_stream = io.StringIO()
+    environment = _environment(output_stream)
+    with environment.pipe([]):
+        environment.output('a')
+    assert 'a\n' == output_stream.getvalue()
+
+
+def test_pipe_writes_to_shell_commands(tmpdir):
+    output_file = tmpdir.join('output')
+    with open(str(output_file), 'wb') as output_stream:
+        environment = _environment(output_stream)
+        with environment.pipe([['sort', '-r']]):
+            environment.output('a')
+            environment.output('b')
+    assert 'b\na\n' == output_file.read()
+
+
+def test_pipe_stops_output_when_shell_commands_close(tmpdir):
+    output_file = tmpdir.join('output')
+    lines = 10 ** 7
+    written = 0
+    with open(str(output_file), 'wb') as output_stream:
+        environment = Environment(output_stream=output_stream)
+        with environment.pipe([['head', '-c', '5']]):
+            for _ in range(lines):
+                environment.output('line')
+                written += 1
+    assert 'line\n' == output_file.read()
+    assert written < lines
+    assert environment.output_stream is output_stream
+
+
+def test_pipe_runs_builtin_filters_and_stops_output_when_done():
+    output_stream = io.StringIO()
+    environment = _environment(output_stream)
+    written = 0
+    with environment.pipe([['head', '2'], ['wc', '-l']]):
+        assert 2 == environment.output_limit
+        for i in range(10):
+            environment.output(str(i))
+            written += 1
+    assert 1 == written
+    assert '2\n' == output_stream.getvalue()
+    assert environment.output_limit is None
@@ -0,0 +1,115 @@
+import pytest
+
+from cdbcli import filters
+from cdbcli.filters import Record
+
+
+def _run(shell_commands, records):
+    builtin_filters, rest = filters.parse_filters(shell_commands)
+    assert [] == rest
+    output = []
+    pipeline = filters.Pipeline(builtin_filters, output.append)
+    for record in records:
+        if pipeline.done:
+            break
+        pipeline.feed(record)
+    pipeline.finish()
+    return output
+
+
+def _records(*texts):
+    return [Record(text, None, None) for text in texts]
+
+
+@pytest.mark.parametrize('shell_command,lines', [
+    (['head'], 10),
+    (['head', '3'], 3),
+    (['head', '-3'], 3),
+    (['head', '-n', '3'], 3),
+    (['head', '-n3'], 3),
+])
+def test_parse_head(shell_command, lines):
+    builtin_filters, rest = filters.parse_filters([shell_command])
+    assert [] == rest
+    assert lines == builtin_filters[0].limit
+
+
+def test_parse_filters_leaves_unknown_commands_and_everything_after_them_to_the_shell():
+    builtin_filters, rest = filters.parse_filters([['grep', 'a'], ['head', '-c', '5'], ['wc', '-l']])
+    assert 1 == len(builtin_filters)
+    assert [['head', '-c', '5'], ['wc', '-l']] == rest
+
+
+@pytest.mark.parametrize('shell_command', [
+    ['grep', '^a'],
+    ['grep', 'a\\|b'],
+    ['grep', '-E', 'a|b'],
+    ['grep', '-E', 'a.b'],
+    ['grep', '-E', '-F', 'a'],
+])
+def test_parse_filters_leaves_regular_expressions_to_the_shell(shell_command):
+    builtin_filters, rest = filters.parse_filters([shell_command])
+    assert [] == builtin_filters
+    assert [shell_command] == rest
+
+
+@pytest.mark.parametrize('shell_command,texts', [
+    (['grep', 'a|b'], ['a|b']),
+    (['grep', '-F', 'a.b'], ['a.b']),
+])
+def test_grep_matches_fixed_strings(shell_command, texts):
+    output = _run([shell_command], _records('a', 'a|b', 'a.b', 'axb'))
+    assert texts == [record.text for record in output]
+
+
+def test_head_takes_the_first_lines_and_is_done():
+    output = _run([['head', '2']], _records('a', 'b', 'c'))
+    assert ['a', 'b'] == [record.text for record in output]
+
+
+def test_head_cuts_multiline_records():
+    output = _run([['head', '2']], _records('a\nb\nc'))
+    assert ['a', 'b'] == [record.text for record in output]
+
+
+def test_head_does_not_highlight_lines_of_cut_records():
+    record = Record('{\n"a": 1\n}', {'a': 1}, object())
+    assert [record] == _run([['head', '3']], [record])
+    assert [None, None] == [line.highlighter for line in _run([['head', '2']], [record])]
+
+
+def test_grep_matches_lines():
+    output = _run([['grep', '-v', 'x']], _records('a', 'xb', 'c\nxd'))
+    assert ['a', 'c'] == [record.text for record in output]
+
+
+def test_grep_ignores_case():
+    output = _run([['grep', '-i', 'A']], _records('a', 'b'))
+    assert ['a'] == [record.text for record in output]
+
+
+def test_wc_counts_lines():
+    output = _run([['head', '3'], ['wc', '-l']], _records('a', 'b\nc', 'd', 'e'))
+    assert ['3'] == [record.text for record in output]
+
+
+def test_jq_gets_the_path_from_the_value():
+    output = _run([['jq', '.value.names[1]']], [Record('', {'value': {'names': ['a', 'b']}}, None)])
+    assert [('"b"', 'b')] == [(record.text, record.value) for record in output]
+
+
+def test_jq_parses_the_text_without_value():
+    output = _run([['jq', '.["a b"]']], _records('{"a b": 1}', '{}'))
+    assert ['1', 'null'] == [record.text for record in output]
+
+
+def test_jq_raises_error_on_text_that_is_not_json():
+    with pytest.raises(RuntimeError):
+        _run([['jq', '.a']], _records('a'))
+
+
+def test_limit_passes_through_filters_that_keep_rows():
+    pipeline = filters.Pipeline(filters.parse_filters([['jq', '.id'], ['head', '5']])[0], None)
+    assert 5 == pipeline.limit
+    pipeline = filters.Pipeline(filters.parse_filters([['grep', 'a'], ['head', '5']])[0], None)
+    assert pipeline.limit is None
@@ -16,3 +16,44 @@ def test_cd():
 def test_cat():
     cmd_text = 'cat xyz'
     _assert_grammar_match(cmd_text, command='cat', doc_id='xyz')
+
+
+def test_ls_with_options():
+    cmd_text = 'ls john --start john.b --limit 10'
+    _assert_grammar_match(cmd_text, command='ls', doc_id_prefix='john', start='john.b', limit='10')
+
+
+def test_exec_with_options():
+    cmd_text = 'exec _design/users:by_lastname --startkey "a" --endkey ["b",1] --limit 5 --descending --include-docs'
+    _assert_grammar_match(cmd_text, command='exec', view_path='_design/users:by_lastname', startkey='"a"',
+                          endkey='["b",1]', limit='5', descending='--descending', include_docs='--include-docs')
+
+
+def test_rm_with_several_ids_and_options():
+    cmd_text = 'rm a session.* b --batch-size 100 --from-file ids.txt'
+    _assert_grammar_match(cmd_text, command='rm', rm_args='a session.* b --batch-size 100 --from-file ids.txt',
+                          batch_size='100', file_name='ids.txt')
+
+
+def test_rm_with_literal_ids():
+    cmd_text = 'rm a --batch-size 10 -- -b c* --ndjson'
+    _assert_grammar_match(cmd_text, command='rm', rm_args='a --batch-size 10 -- -b c* --ndjson', batch_size='10')
+    _assert_grammar_match('rm -- -b', command='rm', rm_args='-- -b', literal_doc_id='-b')
+
+
+def test_cat_with_several_ids_and_options():
+    cmd_text = 'cat a session.* --ndjson --batch-size 10'
+    _assert_grammar_match(cmd_text, command='cat', cat_args='a session.* --ndjson --batch-size 10',
+                          ndjson='--ndjson', batch_size='10')
+
+
+def test_cp_with_options():
+    cmd_text = 'cp users users_copy --selector {"type": "user"} --concurrency 2'
+    _assert_grammar_match(cmd_text, command='cp', source='users', destination='users_copy',
+                          selector='{"type": "user"}', concurrency='2')
+
+
+def test_find_with_options():
+    cmd_text = 'find {"age": {"$gt": -1}} --fields _id,age --sort age:desc --limit 5 --use-index by_age'
+    _assert_grammar_match(cmd_text, command='find', selector='{"age": {"$gt": -1}}', fields='_id,age',
+                          sort='age:desc', limit='5', use_index='by_age')
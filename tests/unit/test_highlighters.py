@@ -0,0 +1,36 @@
+import json
+
+from cdbcli import highlighters
+
+
+def _brackets(text):
+    return '[{}]'.format(text)
+
+
+def test_lexer_and_formatter_are_cached():
+    assert highlighters._get_lexer('JsonLexer') is highlighters._get_lexer('JsonLexer')
+    assert highlighters._get_formatter() is highlighters._get_formatter()
+
+
+def test_json_highlights():
+    assert '\x1b[' in highlighters.json('{"a": 1}')
+
+
+def test_highlighting_adds_no_new_line():
+    assert not highlighters.json('{"a": 1}').endswith('\n')
+
+
+def test_small_text_is_highlighted_at_once():
+    assert ['[a\nb]'] == list(highlighters.iter_highlighted('a\nb', _brackets, chunk_size=10, max_size=100))
+
+
+def test_large_text_is_highlighted_in_chunks():
+    text = json.dumps({'key{}'.format(i): [i, {'nested': True}] for i in range(50)}, indent=4)
+    chunks = list(highlighters.iter_highlighted(text, highlighters.json, chunk_size=100, max_size=len(text)))
+    assert len(chunks) > 1
+    assert highlighters.json(text) == ''.join(chunks)
+
+
+def test_text_above_max_size_is_not_highlighted():
+    text = 'a' * 11
+    assert [text] == list(highlighters.iter_highlighted(text, highlighters.json, chunk_size=5, max_size=10))
@@ -0,0 +1,81 @@
+import pytest
+
+from couchdb.client import Row
+from unittest.mock import Mock
+
+from cdbcli.index import DocIndex
+
+
+def _change(seq, doc_id, rev='1-a', deleted=False):
+    change = {'seq': seq, 'id': doc_id, 'changes': [{'rev': rev}]}
+    if deleted:
+        change['deleted'] = True
+    return change
+
+
+class FakeDatabase():
+    def __init__(self, url='http://localhost:5984/test'):
+        self.resource = Mock(url=url)
+        self.changes_log = []
+        self.design_docs = {}
+        self.changes_requests = []
+
+    def changes(self, since, limit, **options):
+        self.changes_requests.append(since)
+        results = [change for change in self.changes_log if change['seq'] > since][:limit]
+        return {'results': results, 'last_seq': results[-1]['seq'] if results else since}
+
+    def view(self, name, keys, include_docs):
+        return [Row(id=key, key=key, value={}, doc=self.design_docs[key]) for key in keys]
+
+
+@pytest.fixture
+def doc_index(tmpdir):
+    doc_index = DocIndex(str(tmpdir.join('index.db')), changes_page_size=2)
+    yield doc_index
+    doc_index.close()
+
+
+def test_refresh_indexes_database_page_by_page(doc_index):
+    database = FakeDatabase()
+    database.changes_log = [_change(i + 1, 'doc{}'.format(i)) for i in range(5)]
+    doc_index.refresh(database)
+    assert [('doc{}'.format(i), '1-a') for i in range(5)] == list(doc_index.iter_docs(database))
+    assert [0, 2, 4] == database.changes_requests
+
+
+def test_refresh_applies_changes_since_last_seq(doc_index, tmpdir):
+    database = FakeDatabase()
+    database.changes_log = [_change(1, 'a'), _change(2, 'b'), _change(3, 'c')]
+    doc_index.refresh(database)
+
+    database.changes_log += [_change(4, 'a', rev='2-b'), _change(5, 'b', rev='2-c', deleted=True)]
+    reopened = DocIndex(doc_index.path)
+    reopened.refresh(database)
+    assert [('a', '2-b'), ('c', '1-a')] == list(reopened.iter_docs(database))
+    assert 3 == database.changes_requests[-1]
+
+
+def test_refresh_skips_recently_refreshed_database(doc_index):
+    database = FakeDatabase()
+    doc_index.refresh(database)
+    doc_index.refresh(database, max_age=60)
+    assert 1 == len(database.changes_requests)
+
+
+def test_iter_docs_pages_through_range(doc_index):
+    database = FakeDatabase()
+    database.changes_log = [_change(i + 1, doc_id) for i, doc_id in enumerate(['a1', 'a2', 'a3', 'a4', 'b1'])]
+    doc_index.refresh(database)
+    doc_ids = [doc_id for doc_id, _ in doc_index.iter_docs(database, 'a2', 'a\ufff0', page_size=2)]
+    assert ['a2', 'a3', 'a4'] == doc_ids
+    assert ['a1', 'a2', 'a3'] == [doc_id for doc_id, _ in doc_index.iter_docs(database, limit=3, page_size=2)]
+    assert [] == list(doc_index.iter_docs(FakeDatabase('http://localhost:5984/other')))
+
+
+def test_get_views_lists_view_names_of_design_docs(doc_index):
+    database = FakeDatabase()
+    database.changes_log = [_change(1, '_design/users'), _change(2, '_design/empty'), _change(3, 'john')]
+    database.design_docs = {'_design/users': {'views': {'by_name': {}, 'by_age': {}}}, '_design/empty': {}}
+    doc_index.refresh(database)
+    assert [('_design/empty', []), ('_design/users', ['by_age', 'by_name'])] == doc_index.get_views(database)
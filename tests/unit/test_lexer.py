@@ -1,4 +1,7 @@
-from cdbcli.lexer import split_cli_command_and_shell_commands
+from prompt_toolkit.document import Document
+from prompt_toolkit.token import Token
+
+from cdbcli.lexer import lexer, split_cli_command_and_shell_commands, split_commands
 
 
 def test_split_cli_command_no_shell_commands():
@@ -23,3 +26,17 @@ def test_split_cli_command_and_multiple_shell_commands_with_space_in_quotes():
     cli_command, shell_commands = split_cli_command_and_shell_commands('cat foobar | grep ID | cut -d " " -f 2')
     assert cli_command == 'cat foobar'
     assert shell_commands == [['grep', 'ID'], ['cut', '-d', ' ', '-f', '2']]
+
+
+def test_split_commands_on_semicolons_and_new_lines():
+    assert ['cd db', 'ls | head', 'cat a'] == split_commands('cd db; ls | head\n\ncat a;')
+
+
+def test_split_commands_ignores_separators_in_quotes_and_comments():
+    script = '# a comment; not a command\ncat foo | grep "a;b" ; cat \'c\nd\'\n  # indented comment\nls'
+    assert ['cat foo | grep "a;b"', "cat 'c\nd'", 'ls'] == split_commands(script)
+
+
+def test_lexer_highlights_command():
+    tokens = lexer.lex_document(None, Document('ls --limit 2'))(0)
+    assert [(Token.Command, 'l'), (Token.Command, 's')] == tokens[:2]
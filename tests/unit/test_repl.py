@@ -0,0 +1,60 @@
+from io import StringIO
+from unittest.mock import Mock
+
+from prompt_toolkit.document import Document
+
+from cdbcli.environment import Environment
+from cdbcli.repl import Repl
+from cdbcli.session import Session
+
+
+def _create_repl(mocker, *command_texts, couch_server=None, show_transfer=False):
+    config = Mock(username='admin', host='localhost', database=None)
+    repl = Repl(couch_server or Mock(), config, Environment(output_stream=StringIO()), show_transfer=show_transfer)
+    cli = Mock()
+    command_texts = iter(command_texts)
+
+    def run(reset_current_buffer, pre_run):
+        pre_run()
+        for text in command_texts:
+            return Document(text)
+        raise EOFError()
+
+    cli.run.side_effect = run
+    create_cli = mocker.patch.object(repl, '_create_cli', return_value=cli)
+    return repl, create_cli
+
+
+def test_repl_creates_cli_once(mocker):
+    repl, create_cli = _create_repl(mocker, 'man exit', 'man exit', 'man exit')
+    repl._run()
+    assert 1 == create_cli.call_count
+
+
+def test_repl_records_command_timing(mocker):
+    repl, _ = _create_repl(mocker, 'man exit')
+    repl._run()
+    assert 'man exit' == repl.last_command_timing.command
+    assert repl.last_command_timing.elapsed >= 0
+    assert repl.last_command_timing.overhead >= 0
+
+
+def test_repl_refreshes_prompt_after_command(mocker):
+    repl, _ = _create_repl(mocker, 'cd -')
+    repl._environment.previous_db = Mock()
+    repl._environment.previous_db.name = 'test'
+    repl._run()
+    assert [('admin@localhost/test # ')] == [text for _, text in repl._get_prompt_tokens(None)]
+
+
+def test_repl_shows_bytes_transferred_by_command(mocker):
+    couch_server = Mock()
+    couch_server.resource.session = Session()
+    couch_server.resource.session.counter.add(requests=5)  # before the command, e.g., for completion
+    repl, _ = _create_repl(mocker, 'man exit', couch_server=couch_server, show_transfer=True)
+    mocker.patch('cdbcli.repl.eval_', side_effect=lambda *args: couch_server.resource.session.counter.add(
+        requests=2, sent=100, received=2048, decoded=10240))
+    repl._run()
+    assert (2, 100, 2048, 10240) == repl.last_command_transfer
+    output = repl._environment.output_stream.getvalue()
+    assert 'Sent 100.00 bytes, received 2.00 KBs (10.00 KBs decoded) in 2 requests' in output
@@ -0,0 +1,92 @@
+import gzip
+import json
+import socket
+
+import couchdb
+import pytest
+
+from cdbcli.session import Session
+from tests.unit.fixtures import JSONRequestHandler, serve
+
+
+class Handler(JSONRequestHandler):
+    def do_GET(self):
+        if self.path == '/large':
+            self.send_json(200, {'rows': [{'id': 'doc{}'.format(i)} for i in range(10000)]})
+        else:
+            self.send_json(200, {'couchdb': 'Welcome', 'version': '2.3.1'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if self.server.reject_gzip:
+                self.send_json(415, {'error': 'bad_content_type', 'reason': 'gzip'})
+                return
+            body = gzip.decompress(body)
+        self.server.posted.append(self.headers.get('Content-Encoding'))
+        self.send_json(201, {'docs': len(json.loads(body.decode())['docs'])})
+
+
+@pytest.fixture
+def http_server():
+    with serve(Handler, posted=[], reject_gzip=False) as server:
+        yield server
+
+
+def test_session_reuses_connections(http_server):
+    couch_server = couchdb.Server(http_server.url, session=Session())
+    for _ in range(5):
+        assert '2.3.1' == couch_server.version()
+    assert 1 == http_server.connections
+
+
+def test_session_keeps_up_to_pool_size_idle_connections(http_server):
+    pool = Session(pool_size=2).connection_pool
+    conns = [pool.get(http_server.url) for _ in range(3)]
+    for conn in conns:
+        pool.release(http_server.url, conn)
+    assert conns[:2] == pool.conns[('http', http_server.url.split('/')[2])]
+    assert conns[2].sock is None
+
+
+def test_session_sets_read_timeout_and_keepalive(http_server):
+    conn = Session(read_timeout=7, keepalive=True).connection_pool.get(http_server.url)
+    assert 7 == conn.sock.gettimeout()
+    assert conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+    conn.close()
+
+
+def test_session_copy_keeps_settings():
+    session = Session(pool_size=3, connect_timeout=5, keepalive=False).copy(read_timeout=30)
+    pool = session.connection_pool
+    assert (3, 5, 30, False) == (pool.pool_size, pool.connect_timeout, pool.read_timeout, pool.keepalive)
+
+
+def test_session_decodes_gzip_responses_and_counts_bytes(http_server):
+    session = Session()
+    couch_server = couchdb.Server(http_server.url, session=session)
+    _, _, response = couch_server.resource.get_json('large')
+    assert 10000 == len(response['rows'])
+    stats = session.counter.reset()
+    assert 1 == stats.requests
+    assert stats.received * 5 < stats.decoded
+    assert len(json.dumps(response).encode()) == stats.decoded
+    assert (0, 0, 0, 0) == session.counter.reset()
+
+
+def test_session_compresses_large_request_bodies(http_server):
+    session = Session(compress_requests=True)
+    couch_server = couchdb.Server(http_server.url, session=session)
+    couch_server.resource.post_json('db/_bulk_docs', body={'docs': [{'_id': 'a'}]})
+    couch_server.resource.post_json('db/_bulk_docs', body={'docs': [{'_id': 'a' * 100}] * 100})
+    assert [None, 'gzip'] == http_server.posted
+    assert session.counter.reset().sent < 2000
+
+
+def test_session_stops_compressing_request_bodies_when_unsupported(http_server):
+    http_server.reject_gzip = True
+    couch_server = couchdb.Server(http_server.url, session=Session(compress_requests=True))
+    for _ in range(2):
+        _, _, response = couch_server.resource.post_json('db/_bulk_docs', body={'docs': [{'_id': 'a' * 100}] * 100})
+        assert {'docs': 100} == response
+    assert [None, None] == http_server.posted
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import time
+
+import cdbcli
+
+
+# ``cdbcli --version`` and other scripted calls must not pay for the REPL
+STARTUP_BUDGET_SECONDS = 0.5
+
+HEAVY_MODULES = ['couchdb', 'prompt_toolkit', 'pygments', 'cdbcli.repl', 'cdbcli.grammar']
+
+
+def _run_python(code):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(cdbcli.__file__)))
+    return subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True)
+
+
+def test_importing_main_does_not_import_heavy_modules():
+    output = _run_python('import sys, cdbcli.main; print("\\n".join(sys.modules))')
+    loaded = set(output.splitlines())
+    assert [] == [module for module in HEAVY_MODULES if module in loaded]
+
+
+def test_importing_repl_does_not_compile_grammar():
+    output = _run_python('import cdbcli.repl, cdbcli.grammar; print(cdbcli.grammar.grammar._grammar)')
+    assert 'None' == output.strip()
+
+
+def test_version_starts_within_budget():
+    timings = []
+    for _ in range(3):
+        started_at = time.monotonic()
+        _run_python('from cdbcli.main import main; main(["--version"])')
+        timings.append(time.monotonic() - started_at)
+
+    assert min(timings) < STARTUP_BUDGET_SECONDS